@@ -0,0 +1,194 @@
+import atexit
+import json
+import logging
+import threading
+from datetime import datetime
+from fastapi import HTTPException
+from sqlalchemy import insert, inspect, or_, and_, case
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import Log, LOG_ACTION_TYPES, LOG_ACTION_TYPE_OTHER
+
+logger = logging.getLogger(__name__)
+
+# Audit log yozish.
+# 1) record_log - yozuv chaqiruvchining tranzaksiyasiga qo'shiladi (endpoint o'zi commit qilsa).
+# 2) audit_writer - biznes commit CRUD funksiyasi ichida bo'lgan endpointlar uchun: yozuvlar xotiradagi
+#    bufferga tushadi va fon thread ularni BATCH_SIZE ga yetganda yoki FLUSH_INTERVAL da bitta
+#    INSERT (executemany) va bitta commit bilan yozadi. Shutdown (va atexit) da buffer to'liq yoziladi;
+#    jarayon kutilmaganda o'lsa, oxirgi FLUSH_INTERVAL dagi yozuvlar yo'qolishi mumkin.
+# O'qish: action_type va vaqt bo'yicha indekslar, keyset pagination (timestamp, id kamayish tartibida,
+# cursor keyingi sahifa uchun X-Next-Cursor sarlavhasida) va yield_per bilan NDJSON eksport.
+
+BATCH_SIZE = 100
+FLUSH_INTERVAL = 1.0  # soniya
+EXPORT_CHUNK_SIZE = 1000
+
+
+def record_log(db: Session, action: str, user_id: int, details: str = None) -> Log:
+    """Add an audit entry to the caller's transaction (committed together with it)."""
+    db_log = Log(action=action, user_id=user_id, details=details, timestamp=datetime.utcnow())
+    db.add(db_log)
+    return db_log
+
+
+class AuditLogWriter:
+    def __init__(self, session_factory, batch_size: int = BATCH_SIZE, flush_interval: float = FLUSH_INTERVAL):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def write(self, action: str, user_id: int, details: str = None):
+        """Queue an entry; the timestamp is taken now, not at flush time."""
+        entry = {"action": action, "user_id": user_id, "details": details, "timestamp": datetime.utcnow()}
+        with self._lock:
+            self._buffer.append(entry)
+            full = len(self._buffer) >= self.batch_size
+        if self._stopped.is_set():
+            # Shutdown dan keyin kelgan yozuv darhol yoziladi
+            self.flush()
+            return
+        self._ensure_started()
+        if full:
+            self._wakeup.set()
+
+    def flush(self) -> int:
+        """Write everything buffered so far in one transaction. Returns the number of entries."""
+        with self._flush_lock:
+            with self._lock:
+                entries, self._buffer = self._buffer, []
+            if not entries:
+                return 0
+            db = self.session_factory()
+            try:
+                db.execute(insert(Log), entries)
+                db.commit()
+            except Exception:
+                db.rollback()
+                # Yozib bo'lmadi - keyingi flush da qayta urinish uchun bufferga qaytariladi
+                with self._lock:
+                    self._buffer = entries + self._buffer
+                logger.exception("Audit log flush failed (%d entries)", len(entries))
+                return 0
+            finally:
+                db.close()
+            return len(entries)
+
+    def _ensure_started(self):
+        if self._thread is not None or self._stopped.is_set():
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="audit-log-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def close(self):
+        """Stop the background thread and flush what is left (called on shutdown)."""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+        self.flush()
+
+
+audit_writer = AuditLogWriter(SessionLocal)
+
+
+def init_audit_log(engine):
+    """
+    Bring an existing logs table up to date: add action_type, fill it for old rows
+    and create the (action_type, timestamp) and (user_id, timestamp) indexes.
+    """
+    with engine.begin() as conn:
+        columns = {column["name"] for column in inspect(conn).get_columns("logs")}
+        if "action_type" not in columns:
+            conn.exec_driver_sql("ALTER TABLE logs ADD COLUMN action_type VARCHAR")
+        conn.execute(
+            Log.__table__.update()
+            .where(Log.action_type == None)
+            .values(action_type=case(LOG_ACTION_TYPES, value=Log.action, else_=LOG_ACTION_TYPE_OTHER))
+        )
+        for index in Log.__table__.indexes:
+            index.create(conn, checkfirst=True)
+
+
+def filter_logs(query, action_types=None, user_id: int = None, since: datetime = None, until: datetime = None):
+    if action_types:
+        query = query.filter(Log.action_type.in_(action_types))
+    if user_id is not None:
+        query = query.filter(Log.user_id == user_id)
+    if since is not None:
+        query = query.filter(Log.timestamp >= since)
+    if until is not None:
+        query = query.filter(Log.timestamp < until)
+    return query
+
+
+def _parse_cursor(cursor: str):
+    try:
+        timestamp, log_id = cursor.rsplit("|", 1)
+        return datetime.fromisoformat(timestamp), int(log_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def serialize_log(log: Log) -> dict:
+    return {
+        "id": log.id,
+        "action": log.action,
+        "action_type": log.action_type,
+        "user_id": log.user_id,
+        "details": log.details,
+        "timestamp": log.timestamp
+    }
+
+
+def page_logs(db: Session, limit: int, cursor: str = None, **filters):
+    """
+    One page of logs, newest first. Returns (items, next_cursor); next_cursor is None on the last page.
+    The cursor is the (timestamp, id) of the last row, so deep pages cost the same as the first one.
+    """
+    query = filter_logs(db.query(Log), **filters)
+    if cursor:
+        timestamp, log_id = _parse_cursor(cursor)
+        query = query.filter(or_(
+            Log.timestamp < timestamp,
+            and_(Log.timestamp == timestamp, Log.id < log_id)
+        ))
+    rows = query.order_by(Log.timestamp.desc(), Log.id.desc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = f"{last.timestamp.isoformat()}|{last.id}"
+    return [serialize_log(log) for log in rows], next_cursor
+
+
+def export_logs(**filters):
+    """
+    NDJSON lines of every matching log, oldest first. Uses its own session: the request's
+    session is closed before a streaming response is sent. Rows are fetched EXPORT_CHUNK_SIZE at a time.
+    """
+    db = SessionLocal()
+    try:
+        query = filter_logs(db.query(Log), **filters).order_by(Log.timestamp, Log.id)
+        for log in query.yield_per(EXPORT_CHUNK_SIZE):
+            # /logs/ javobi bilan bir xil ISO-8601 vaqt formati
+            entry = serialize_log(log)
+            entry["timestamp"] = log.timestamp.isoformat() if log.timestamp else None
+            yield json.dumps(entry, ensure_ascii=False) + "\n"
+    finally:
+        db.close()
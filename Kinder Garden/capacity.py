@@ -0,0 +1,201 @@
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+from models import Ingredient, Meal, MealIngredient
+import numpy as np
+
+# Portsiya sig'imi (capacity) hisoblash.
+# Retseptlar matritsasi (ovqatlar × ingrediyentlar) va ombor vektori ikkita so'rov bilan yuklanadi,
+# keyin barcha ovqatlar uchun mumkin bo'lgan portsiyalar NumPy bilan bir martada hisoblanadi:
+#   portions[m] = floor(min_i(stock[i] / recipe[m, i]))   (recipe[m, i] > 0 bo'lganlar bo'yicha)
+# Eng kam portsiya beradigan ingrediyent - "bottleneck" (ovqatni cheklayotgan ingrediyent).
+# Haftalik menyu rejasi ham shu matritsa ustida: talab = recipe.T @ plan (ingrediyentlar × kunlar).
+
+MAX_PLAN_DAYS = 31
+
+
+class RecipeMatrix:
+    """Recipe matrix, stock vector and the id/name lookups needed to read them back."""
+
+    def __init__(self, meal_ids, meal_names, ingredient_ids, ingredient_names, recipe, stock, minimum):
+        self.meal_ids = meal_ids
+        self.meal_names = meal_names
+        self.ingredient_ids = ingredient_ids
+        self.ingredient_names = ingredient_names
+        self.recipe = recipe      # (meals, ingredients), bir portsiya uchun gramm
+        self.stock = stock        # (ingredients,), ombordagi miqdor
+        self.minimum = minimum    # (ingredients,), minimum_quantity
+        self.meal_index = {meal_id: row for row, meal_id in enumerate(meal_ids)}
+        self.ingredient_index = {ingredient_id: col for col, ingredient_id in enumerate(ingredient_ids)}
+
+
+def load_recipe_matrix(db: Session, meal_ids=None) -> RecipeMatrix:
+    """
+    Load the recipe matrix and stock vector in two queries.
+
+    Args:
+        db (Session): Database session
+        meal_ids (list, optional): Restrict the matrix to these meals (all meals by default)
+    """
+    # 1-so'rov: ombor vektori
+    ingredients = db.query(
+        Ingredient.id, Ingredient.name, Ingredient.quantity, Ingredient.minimum_quantity
+    ).order_by(Ingredient.id).all()
+    ingredient_ids = [row.id for row in ingredients]
+    ingredient_names = [row.name for row in ingredients]
+    stock = np.array([row.quantity or 0.0 for row in ingredients], dtype=float)
+    minimum = np.array([row.minimum_quantity or 0.0 for row in ingredients], dtype=float)
+    ingredient_index = {ingredient_id: col for col, ingredient_id in enumerate(ingredient_ids)}
+
+    # 2-so'rov: retseptlar (ingrediyentsiz ovqatlar ham qatnashishi uchun outer join)
+    query = db.query(
+        Meal.id, Meal.name, MealIngredient.ingredient_id, MealIngredient.quantity
+    ).outerjoin(MealIngredient, MealIngredient.meal_id == Meal.id)
+    if meal_ids is not None:
+        query = query.filter(Meal.id.in_(meal_ids))
+    rows = query.order_by(Meal.id).all()
+
+    meal_index, meal_names = {}, []
+    cells = []
+    for meal_id, meal_name, ingredient_id, quantity in rows:
+        if meal_id not in meal_index:
+            meal_index[meal_id] = len(meal_names)
+            meal_names.append(meal_name)
+        if ingredient_id is not None and ingredient_id in ingredient_index:
+            cells.append((meal_index[meal_id], ingredient_index[ingredient_id], quantity or 0.0))
+
+    recipe = np.zeros((len(meal_names), len(ingredient_ids)), dtype=float)
+    if cells:
+        rows_idx, cols_idx, values = zip(*cells)
+        # Bir ovqatda bir ingrediyent ikki marta yozilgan bo'lsa, miqdorlar qo'shiladi
+        np.add.at(recipe, (np.array(rows_idx), np.array(cols_idx)), np.array(values, dtype=float))
+
+    return RecipeMatrix(list(meal_index), meal_names, ingredient_ids, ingredient_names, recipe, stock, minimum)
+
+
+def compute_capacity(recipe: np.ndarray, stock: np.ndarray):
+    """
+    Possible portions and bottleneck column per meal.
+
+    Returns (portions, bottleneck): portions is an int array, bottleneck holds the
+    ingredient column limiting each meal or -1 for meals without (positive) ingredients.
+    """
+    used = recipe > 0
+    ratios = np.full(recipe.shape, np.inf)
+    np.divide(np.maximum(stock, 0.0), recipe, out=ratios, where=used)
+
+    has_ingredients = used.any(axis=1)
+    bottleneck = np.where(has_ingredients, ratios.argmin(axis=1) if recipe.size else -1, -1)
+    limit = ratios.min(axis=1, initial=np.inf)
+    portions = np.where(has_ingredients, np.floor(np.where(np.isfinite(limit), limit, 0.0)), 0.0).astype(int)
+    return portions, bottleneck
+
+
+def meal_capacities(db: Session, meal_ids=None) -> list:
+    """Possible portions per meal with the bottleneck ingredient (two queries, one NumPy pass)."""
+    matrix = load_recipe_matrix(db, meal_ids)
+    portions, bottleneck = compute_capacity(matrix.recipe, matrix.stock)
+
+    result = []
+    for row, meal_id in enumerate(matrix.meal_ids):
+        col = int(bottleneck[row])
+        result.append({
+            "meal_id": meal_id,
+            "meal_name": matrix.meal_names[row],
+            "possible_portions": int(portions[row]),
+            "bottleneck_ingredient_id": matrix.ingredient_ids[col] if col >= 0 else None,
+            "bottleneck_ingredient_name": matrix.ingredient_names[col] if col >= 0 else None,
+            "bottleneck_quantity": float(matrix.stock[col]) if col >= 0 else None,
+            "required_per_portion": float(matrix.recipe[row, col]) if col >= 0 else None,
+        })
+    return result
+
+
+def total_possible_portions(db: Session) -> int:
+    """Sum of possible portions over all meals."""
+    matrix = load_recipe_matrix(db)
+    portions, _ = compute_capacity(matrix.recipe, matrix.stock)
+    return int(portions.sum())
+
+
+def plan_menu(db: Session, menu: dict) -> dict:
+    """
+    Ingredient requirements for a menu plan {meal_id: [portions for day 1, day 2, ...]}.
+
+    Requirements are recipe.T @ plan; the running total per day is compared with the stock
+    to find on which day each ingredient runs out. The purchase list covers the whole plan
+    and brings every ingredient back to its minimum_quantity.
+    """
+    if not menu:
+        raise HTTPException(status_code=400, detail="Menu plan is empty")
+    days = max(len(portions) for portions in menu.values())
+    if days == 0 or days > MAX_PLAN_DAYS:
+        raise HTTPException(status_code=400, detail=f"Plan must cover 1 to {MAX_PLAN_DAYS} days")
+    if any(p < 0 for portions in menu.values() for p in portions):
+        raise HTTPException(status_code=400, detail="Planned portions cannot be negative")
+
+    matrix = load_recipe_matrix(db, list(menu))
+    missing = sorted(set(menu) - set(matrix.meal_index))
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Meal ID {missing[0]} not found")
+
+    # Reja matritsasi: ovqatlar × kunlar (qisqa ro'yxatlar oxiri 0 bilan to'ldiriladi)
+    plan = np.zeros((len(matrix.meal_ids), days), dtype=float)
+    for meal_id, portions in menu.items():
+        plan[matrix.meal_index[meal_id], :len(portions)] = portions
+
+    required = matrix.recipe.T @ plan                      # ingrediyentlar × kunlar
+    cumulative = required.cumsum(axis=1)
+    available = np.maximum(matrix.stock, 0.0)[:, None]
+    # Har bir kunda qancha yetishmasligi (oldingi kunlarda yetishmagan miqdor qayta sanalmaydi)
+    daily_shortfall = np.diff(np.maximum(cumulative - available, 0.0), axis=1, prepend=0.0)
+    total_required = cumulative[:, -1]
+    remaining = matrix.stock - total_required
+    purchase = np.maximum(total_required + matrix.minimum - matrix.stock, 0.0)
+
+    used = np.flatnonzero(total_required > 0)
+    ingredients = [
+        {
+            "ingredient_id": matrix.ingredient_ids[col],
+            "ingredient_name": matrix.ingredient_names[col],
+            "quantity": float(matrix.stock[col]),
+            "minimum_quantity": float(matrix.minimum[col]),
+            "required_total": round(float(total_required[col]), 3),
+            "required_per_day": [round(float(v), 3) for v in required[col]],
+            "remaining_after_plan": round(float(remaining[col]), 3),
+            "below_minimum": bool(remaining[col] < matrix.minimum[col]),
+        }
+        for col in used
+    ]
+
+    shortfalls = []
+    for day in range(days):
+        short = np.flatnonzero(daily_shortfall[:, day] > 1e-9)
+        if len(short):
+            shortfalls.append({
+                "day": day + 1,
+                "ingredients": [
+                    {
+                        "ingredient_id": matrix.ingredient_ids[col],
+                        "ingredient_name": matrix.ingredient_names[col],
+                        "shortfall": round(float(daily_shortfall[col, day]), 3),
+                    }
+                    for col in short
+                ],
+            })
+
+    purchase_list = [
+        {
+            "ingredient_id": matrix.ingredient_ids[col],
+            "ingredient_name": matrix.ingredient_names[col],
+            "quantity": round(float(purchase[col]), 3),
+        }
+        for col in np.flatnonzero(purchase > 1e-9)
+        if total_required[col] > 0 or matrix.stock[col] < matrix.minimum[col]
+    ]
+
+    return {
+        "days": days,
+        "ingredients": ingredients,
+        "shortfalls": shortfalls,
+        "purchase_list": purchase_list,
+    }
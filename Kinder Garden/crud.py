@@ -1,11 +1,11 @@
 from sqlalchemy.orm import Session, joinedload
-from models import Ingredient, Meal, MealIngredient, MealServe, User, Log
+from models import Ingredient, Meal, MealIngredient, MealServe, User, Log, DailyMealServe
 from schemas import IngredientCreate, IngredientUpdate, MealCreate, MealUpdate, MealServeCreate, UserCreate
 from fastapi import HTTPException
 from sqlalchemy import func
-from datetime import datetime
-import math
+from datetime import datetime, date
 from auth import get_password_hash
+from capacity import meal_capacities, total_possible_portions
 
 # Ingredient CRUD
 def create_ingredient(db: Session, ingredient: IngredientCreate):
@@ -161,30 +161,10 @@ def get_meal_serves_by_user(db: Session, user_id: int, skip: int = 0, limit: int
 
 # Portions hisoblash
 def calculate_portions(db: Session, meal_id: int):
-    db_meal = db.query(Meal).options(joinedload(Meal.ingredients)).filter(Meal.id == meal_id).first()
-    if not db_meal:
+    capacities = meal_capacities(db, [meal_id])
+    if not capacities:
         raise HTTPException(status_code=404, detail="Meal not found")
-
-    if not db_meal.ingredients:
-        return 0
-
-    portions = float('inf')
-    for meal_ingredient in db_meal.ingredients:
-        db_ingredient = db.query(Ingredient).filter(Ingredient.id == meal_ingredient.ingredient_id).first()
-        if not db_ingredient:
-            raise HTTPException(status_code=404, detail=f"Ingredient ID {meal_ingredient.ingredient_id} not found")
-        if meal_ingredient.quantity == 0:
-            continue
-        
-        # Convert both values to float before division
-        ingredient_quantity = float(db_ingredient.quantity)
-        recipe_quantity = float(meal_ingredient.quantity)
-        
-        # Now perform the division with converted values
-        available_portions = ingredient_quantity / recipe_quantity
-        portions = min(portions, available_portions)
-    
-    return math.floor(portions)
+    return capacities[0]["possible_portions"]
 
 def get_all_portions(db: Session, skip: int = 0, limit: int = 100):
     try:
@@ -218,17 +198,16 @@ def get_monthly_report(db: Session, year: int, month: int):
         year (int): Year to generate report for
         month (int): Month to generate report for
     """
-    total_served = db.query(func.count(MealServe.id)).filter(
-        func.extract('year', MealServe.served_at) == year,
-        func.extract('month', MealServe.served_at) == month
+    # Kunlik rollup dan (date bo'yicha diapazon - primary key indeksidan foydalanadi)
+    start_date = date(year, month, 1)
+    end_date = date(year, month + 1, 1) if month < 12 else date(year + 1, 1, 1)
+    total_served = db.query(func.sum(DailyMealServe.serve_count)).filter(
+        DailyMealServe.date >= start_date,
+        DailyMealServe.date < end_date
     ).scalar() or 0
 
-    # Rest of the function remains the same
-    total_possible = 0
-    meals = db.query(Meal).options(joinedload(Meal.ingredients)).all()
-    for meal in meals:
-        portions = calculate_portions(db, meal.id)
-        total_possible += portions
+    # Barcha ovqatlar uchun bitta NumPy hisob (retseptlar va ombor ikki so'rovda)
+    total_possible = total_possible_portions(db)
 
     if total_possible == 0:
         difference_percentage = 0.0
@@ -251,14 +230,19 @@ def get_monthly_report(db: Session, year: int, month: int):
     }
 
 def get_ingredient_usage(db: Session):
+    # Har bir ovqat uchun jami portsiyalar rollup dan (serve lar soniga bog'liq emas)
+    served = db.query(
+        DailyMealServe.meal_id.label('meal_id'),
+        func.sum(DailyMealServe.portions).label('portions')
+    ).group_by(DailyMealServe.meal_id).subquery()
+
     usage = db.query(
         Ingredient.id,
         Ingredient.name,
         Ingredient.delivery_date,
-        func.sum(MealIngredient.quantity * MealServe.portions).label('total_used')
+        func.sum(MealIngredient.quantity * served.c.portions).label('total_used')
     ).join(MealIngredient, Ingredient.id == MealIngredient.ingredient_id
-    ).join(Meal, MealIngredient.meal_id == Meal.id
-    ).join(MealServe, MealServe.meal_id == Meal.id, isouter=True
+    ).join(served, served.c.meal_id == MealIngredient.meal_id, isouter=True
     ).group_by(Ingredient.id, Ingredient.name, Ingredient.delivery_date).all()
 
     result = [
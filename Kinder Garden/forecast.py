@@ -0,0 +1,87 @@
+from datetime import date, timedelta
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+from models import DailyMealServe
+from capacity import load_recipe_matrix
+import numpy as np
+
+# Ingrediyentlar tugash prognozi.
+# Kunlik sarf = kunlik rollup (kunlar × ovqatlar) @ retseptlar matritsasi (ovqatlar × ingrediyentlar),
+# ya'ni tarix alohida serve lar emas, daily_meal_serves qatorlari orqali o'qiladi. Sarf darajasi
+# eksponensial tekislash (exponential smoothing) bilan, barcha ingrediyentlar uchun bitta og'irliklar
+# vektori ko'paytmasida hisoblanadi. Eslatma: o'tgan serve lar joriy retsept bo'yicha hisoblanadi.
+
+DEFAULT_ALPHA = 0.3
+DEFAULT_LOOKBACK_DAYS = 90
+
+
+def smoothing_weights(n: int, alpha: float) -> np.ndarray:
+    """
+    Weights w such that w @ x equals the last level of simple exponential smoothing
+    started at x[0]: level_t = alpha * x_t + (1 - alpha) * level_(t-1).
+    """
+    powers = (1.0 - alpha) ** np.arange(n - 1, -1, -1)
+    weights = alpha * powers
+    weights[0] = powers[0]
+    return weights
+
+
+def forecast_depletion(db: Session, alpha: float = DEFAULT_ALPHA, lookback_days: int = DEFAULT_LOOKBACK_DAYS,
+                       today: date = None) -> list:
+    """
+    Smoothed daily consumption and projected depletion per ingredient (three queries).
+
+    Args:
+        db (Session): Database session
+        alpha (float): Smoothing factor, higher values follow recent days more closely
+        lookback_days (int): Number of full days of history to use (today is excluded)
+    """
+    if not 0 < alpha <= 1:
+        raise HTTPException(status_code=400, detail="alpha must be in (0, 1]")
+    if lookback_days < 1:
+        raise HTTPException(status_code=400, detail="lookback_days must be positive")
+
+    today = today or date.today()
+    start = today - timedelta(days=lookback_days)
+    matrix = load_recipe_matrix(db)
+    rows = db.query(DailyMealServe.date, DailyMealServe.meal_id, DailyMealServe.portions).filter(
+        DailyMealServe.date >= start,
+        DailyMealServe.date < today
+    ).all()
+
+    # Tarix birinchi serve kunidan boshlanadi (yangi oshxona uchun bo'sh kunlar sarfni pasaytirmasin)
+    first_day = min((row.date for row in rows), default=today)
+    days = (today - first_day).days
+    consumption = np.zeros((days, len(matrix.ingredient_ids)))
+    if days and rows:
+        served = np.zeros((days, len(matrix.meal_ids)))
+        for served_date, meal_id, portions in rows:
+            row = matrix.meal_index.get(meal_id)
+            if row is not None:
+                served[(served_date - first_day).days, row] += portions
+        consumption = served @ matrix.recipe
+
+    daily_rate = smoothing_weights(days, alpha) @ consumption if days else np.zeros(len(matrix.ingredient_ids))
+
+    stock = matrix.stock
+    with np.errstate(divide="ignore", invalid="ignore"):
+        days_left = np.where(daily_rate > 0, np.maximum(stock, 0.0) / daily_rate, np.inf)
+        days_to_minimum = np.where(daily_rate > 0, np.maximum(stock - matrix.minimum, 0.0) / daily_rate, np.inf)
+
+    def projected(offset):
+        return today + timedelta(days=int(np.floor(offset))) if np.isfinite(offset) else None
+
+    return [
+        {
+            "ingredient_id": ingredient_id,
+            "ingredient_name": matrix.ingredient_names[col],
+            "quantity": float(stock[col]),
+            "minimum_quantity": float(matrix.minimum[col]),
+            "daily_consumption": round(float(daily_rate[col]), 3),
+            "days_left": round(float(days_left[col]), 1) if np.isfinite(days_left[col]) else None,
+            "depletion_date": projected(days_left[col]),
+            "days_to_minimum": round(float(days_to_minimum[col]), 1) if np.isfinite(days_to_minimum[col]) else None,
+            "minimum_date": projected(days_to_minimum[col]),
+        }
+        for col, ingredient_id in enumerate(matrix.ingredient_ids)
+    ]
@@ -1,29 +1,38 @@
-from fastapi import FastAPI, Depends, HTTPException, Query
+from fastapi import FastAPI, Depends, HTTPException, Query, Response, WebSocket, WebSocketDisconnect, BackgroundTasks
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from datetime import datetime
 import jwt
 from fastapi.middleware.cors import CORSMiddleware
-from database import SessionLocal, engine, Base
+from database import SessionLocal, engine
 from crud import (
     get_user_by_username, create_user, get_meal, create_meal, get_meals,
     update_meal, delete_meal, get_ingredient, create_ingredient,
-    update_ingredient, delete_ingredient, get_meal_ingredients_by_meal,
-    delete_meal_ingredients_by_meal, get_all_portions, serve_meal,
-    get_meal_serves_by_user, get_monthly_report, get_ingredient_usage,
-    create_log
+    update_ingredient, delete_ingredient, get_all_portions, serve_meal,
+    get_meal_serves_by_user, get_monthly_report, get_ingredient_usage
 )
-from models import MealServe as MealServeModel, User as UserModel, Meal as MealModel, Ingredient as IngredientModel, MealIngredient, Log
+from models import Base, MealServe as MealServeModel, User as UserModel, Meal as MealModel, Ingredient as IngredientModel, MealIngredient, Log
 from sqlalchemy.orm import joinedload
 from schemas import (
     User, UserCreate, Token, Meal, MealCreate, MealUpdate, Ingredient,
     IngredientCreate, IngredientUpdate, MealPortions, MealServe,
-    MealServeCreate, MonthlyReport, IngredientUsage, Role, TaskResponse
+    MealServeCreate, IngredientUsage, Role, TaskResponse, MealCapacity,
+    MenuPlanRequest, MenuPlanResponse, MealServeBatch, IngredientForecast
 )
 from auth import oauth2_scheme, create_access_token, get_current_user, require_any_role, require_role
 from celery.result import AsyncResult
-from tasks import celery_app, generate_monthly_report, check_ingredients_quantity
+from tasks import celery_app, generate_monthly_report, check_ingredients_quantity, schedule_stock_check
+from capacity import meal_capacities, plan_menu
+from forecast import forecast_depletion
+from serving import serve_meals
+from websocket import manager
+from audit import audit_writer, record_log, init_audit_log, page_logs, export_logs
+from rollup import init_daily_rollup
+from reports import (
+    init_report_versions, data_version, report_task_id, get_cached_report, current_report_job, claim_report_job
+)
 
 app = FastAPI()
 
@@ -34,10 +43,19 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
-# Database setup
+# Database setup (jadvallar models.Base da)
 Base.metadata.create_all(bind=engine)
+init_report_versions(engine)
+init_daily_rollup(engine)
+init_audit_log(engine)
+
+@app.on_event("shutdown")
+def flush_audit_log():
+    # Buferdagi audit yozuvlari yo'qolmasligi uchun
+    audit_writer.close()
 
 # Dependency
 def get_db():
@@ -86,8 +104,8 @@ def create_new_ingredient(
     current_user: User = Depends(require_any_role([Role.ADMIN, Role.MANAGER]))
 ):
     db_ingredient = create_ingredient(db=db, ingredient=ingredient)
-    create_log(
-        db, 
+    manager.mark_changed()
+    audit_writer.write(
         action="Ingrediyent yaratildi",
         user_id=current_user.id,
         details=f"Name: {ingredient.name}, Quantity: {ingredient.quantity}"
@@ -114,12 +132,16 @@ def read_ingredient(ingredient_id: int, db: Session = Depends(get_db)):
 def update_existing_ingredient(
     ingredient_id: int,
     ingredient: IngredientUpdate,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
     current_user: User = Depends(require_any_role([Role.ADMIN, Role.MANAGER]))
 ):
     db_ingredient = update_ingredient(db=db, ingredient_id=ingredient_id, ingredient=ingredient)
-    create_log(
-        db, 
+    if db_ingredient:
+        manager.mark_changed()
+        # Ombor to'ldirilgan bo'lsa ogohlantirish holati ham yangilanadi (javobdan keyin, Redis xatosi 500 bermaydi)
+        background_tasks.add_task(schedule_stock_check, [ingredient_id])
+    audit_writer.write(
         action="Ingrediyent yangilandi",
         user_id=current_user.id,
         details=f"ID: {ingredient_id}, New Name: {ingredient.name}, New Quantity: {ingredient.quantity}"
@@ -133,8 +155,8 @@ def delete_existing_ingredient(
     current_user: User = Depends(require_any_role([Role.ADMIN, Role.MANAGER]))
 ):
     db_ingredient = delete_ingredient(db=db, ingredient_id=ingredient_id)
-    create_log(
-        db, 
+    manager.mark_changed()
+    audit_writer.write(
         action="Ingrediyent o'chirildi",
         user_id=current_user.id,
         details=f"ID: {ingredient_id}"
@@ -149,8 +171,8 @@ def create_new_meal(
     current_user: User = Depends(require_any_role([Role.ADMIN, Role.MANAGER]))
 ):
     db_meal = create_meal(db=db, meal=meal)
-    create_log(
-        db, 
+    manager.mark_changed()
+    audit_writer.write(
         action="Ovqat yaratildi",
         user_id=current_user.id,
         details=f"Name: {meal.name}"
@@ -184,7 +206,8 @@ def update_existing_meal(
     if not db_meal:
         raise HTTPException(status_code=404, detail="Meal not found")
 
-    delete_meal_ingredients_by_meal(db, meal_id)
+    # Eski retsept, yangi retsept va audit log - bitta tranzaksiya, bitta commit
+    db.query(MealIngredient).filter(MealIngredient.meal_id == meal_id).delete(synchronize_session=False)
     db_meal.name = meal_update.name
     for ingredient in meal_update.ingredients:
         db_meal_ingredient = MealIngredient(
@@ -193,10 +216,10 @@ def update_existing_meal(
             quantity=ingredient.quantity
         )
         db.add(db_meal_ingredient)
+    record_log(db, action="Ovqat yangilandi", user_id=current_user.id, details=f"Meal ID: {meal_id}, New Name: {meal_update.name}")
     db.commit()
+    manager.mark_changed()
     db.refresh(db_meal)
-
-    create_log(db, action="Ovqat yangilandi", user_id=current_user.id, details=f"Meal ID: {meal_id}, New Name: {meal_update.name}")
     return db_meal
 
 @app.delete("/meals/{meal_id}/", status_code=204)
@@ -212,16 +235,17 @@ async def delete_meal(
     try:
         meal_name = meal.name
         db.delete(meal)
-        db.commit()
-        create_log(
-            db, 
+        record_log(
+            db,
             action="Ovqat o'chirildi",
             user_id=current_user.id,
             details=f"ID: {meal_id}, Name: {meal_name}"
         )
+        db.commit()
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to delete meal: {str(e)}")
+    manager.mark_changed()
     
     return None
 
@@ -230,61 +254,33 @@ async def delete_meal(
 def serve_new_meal(
     meal_id: int,
     meal_serve: MealServeCreate,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
     current_user: User = Depends(require_any_role([Role.ADMIN, Role.CHEF]))
 ):
     if meal_serve.meal_id != meal_id:
         raise HTTPException(status_code=400, detail="Meal ID mismatch")
 
-    meal = get_meal(db, meal_id)
-    if not meal:
-        raise HTTPException(status_code=404, detail="Meal not found")
-
-    meal_ingredients = get_meal_ingredients_by_meal(db, meal_id)
-    for mi in meal_ingredients:
-        ingredient = get_ingredient(db, mi.ingredient_id)
-        required_quantity = float(mi.quantity) * float(meal_serve.portions)
-        current_quantity = float(ingredient.quantity)
-        
-        if current_quantity < required_quantity:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Insufficient quantity of ingredient: {ingredient.name}. Need {required_quantity}g, have {current_quantity}g"
-            )
-        ingredient.quantity = current_quantity - required_quantity
-        check_ingredients_quantity.delay(ingredient.id)  # Asinxron tekshirish
-
-    db.commit()
-
-    db_meal_serve = MealServeModel(
-        meal_id=meal_id,
-        user_id=current_user.id,
-        served_at=datetime.now(),
-        portions=meal_serve.portions
-    )
-    db.add(db_meal_serve)
-    db.commit()
-    db.refresh(db_meal_serve)
-
-    db_meal_serve = db.query(MealServeModel).options(
-        joinedload(MealServeModel.meal)
-    ).filter(MealServeModel.id == db_meal_serve.id).first()
+    served, low_stock_ids = serve_meals(db, [(meal_id, meal_serve.portions)], current_user.id)
+    manager.mark_changed()
+    # Serve commit qilingan: tekshiruv javobdan keyin navbatga qo'yiladi (Redis xatosi javobni buzmaydi)
+    background_tasks.add_task(schedule_stock_check, low_stock_ids)
+    return served[0]
 
-    create_log(
-        db, 
-        action="Ovqat berildi", 
-        user_id=current_user.id, 
-        details=f"Meal: {db_meal_serve.meal.name}, Portions: {meal_serve.portions}"
+@app.post("/serve-meals/batch/", response_model=List[MealServe])
+def serve_meal_batch(
+    batch: MealServeBatch,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(require_any_role([Role.ADMIN, Role.CHEF]))
+):
+    """Serve several meals at once: all or nothing, one transaction."""
+    served, low_stock_ids = serve_meals(
+        db, [(serve.meal_id, serve.portions) for serve in batch.serves], current_user.id
     )
-    
-    return {
-        "id": db_meal_serve.id,
-        "meal_id": db_meal_serve.meal_id,
-        "meal_name": db_meal_serve.meal.name if db_meal_serve.meal else "Unknown meal",
-        "user_id": db_meal_serve.user_id,
-        "served_at": db_meal_serve.served_at,
-        "portions": db_meal_serve.portions
-    }
+    manager.mark_changed()
+    background_tasks.add_task(schedule_stock_check, low_stock_ids)
+    return served
 
 # Serve Meals endpoints
 @app.get("/serve-meals/", response_model=List[dict])
@@ -340,33 +336,68 @@ def get_portions(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching portions: {str(e)}")
 
+@app.get("/api/portions/capacity/", response_model=List[MealCapacity])
+def get_portion_capacity(db: Session = Depends(get_db)):
+    """Possible portions per meal from current stock, with the ingredient that limits each meal."""
+    return meal_capacities(db)
+
+# Forecast endpoint
+@app.get("/forecast/ingredients/", response_model=List[IngredientForecast])
+def read_ingredient_forecast(
+    alpha: float = Query(default=0.3, gt=0, le=1),
+    lookback_days: int = Query(default=90, ge=7, le=730),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(require_any_role([Role.ADMIN, Role.MANAGER]))
+):
+    """Smoothed daily consumption and projected depletion date per ingredient."""
+    return forecast_depletion(db, alpha=alpha, lookback_days=lookback_days)
+
+# Menu planning endpoint
+@app.post("/planning/menu/", response_model=MenuPlanResponse)
+def plan_weekly_menu(
+    plan: MenuPlanRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(require_any_role([Role.ADMIN, Role.MANAGER]))
+):
+    return plan_menu(db, plan.menu)
+
 # Reports endpoints
-@app.get("/reports/monthly/{year}/{month}/", response_model=MonthlyReport)
-async def read_monthly_report(
+def _check_period(year: int, month: int):
+    if not 1 <= month <= 12 or not 2000 <= year <= 2100:
+        raise HTTPException(status_code=400, detail="Invalid year or month")
+
+@app.get("/reports/monthly/{year}/{month}/", response_model=TaskResponse)
+def read_monthly_report(
     year: int,
     month: int,
     db: Session = Depends(get_db),
     current_user: User = Depends(require_any_role([Role.ADMIN, Role.MANAGER]))
 ):
-    try:
-        task = generate_monthly_report.delay(year, month)
-        try:
-            report = task.get(timeout=30)  # Increased timeout
-            if not report:
-                raise HTTPException(status_code=404, detail="Report not found")
-                
-            return MonthlyReport(**report)
-            
-        except TimeoutError:
-            raise HTTPException(
-                status_code=408,
-                detail="Report generation timed out"
-            )
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error: {str(e)}"
-        )
+    """
+    Submit a report job. Returns the cached report at once if the month's data
+    has not changed, otherwise a job id to poll at /reports/monthly/{year}/{month}/status/.
+    """
+    _check_period(year, month)
+    version = data_version(db, year, month)
+    cached = get_cached_report(year, month, version)
+    if cached:
+        task_id = current_report_job(year, month, version) or report_task_id(year, month, version)
+        return {"task_id": task_id, "status": "SUCCESS", "result": cached}
+
+    # Navbatdagi job ham PENDING ko'rinadi: job faqat yuborish kalitini olgan so'rov tomonidan yuboriladi
+    task_id = claim_report_job(year, month, version)
+    if task_id is None:
+        task_id = current_report_job(year, month, version) or report_task_id(year, month, version)
+        task = AsyncResult(task_id, app=celery_app)
+        if task.status != "FAILURE":
+            return {"task_id": task_id, "status": task.status, "result": task.result if task.status == "SUCCESS" else None}
+        # Eski id da FAILURE natijasi qoladi - qayta urinish yangi id bilan
+        task_id = claim_report_job(year, month, version, failed_job_id=task_id)
+        if task_id is None:
+            task_id = current_report_job(year, month, version) or report_task_id(year, month, version)
+            return {"task_id": task_id, "status": "PENDING", "result": None}
+    generate_monthly_report.apply_async((year, month), task_id=task_id)
+    return {"task_id": task_id, "status": "PENDING", "result": None}
 
 @app.get("/reports/ingredient-usage/", response_model=List[IngredientUsage])
 def read_ingredient_usage(
@@ -376,22 +407,54 @@ def read_ingredient_usage(
     usage = get_ingredient_usage(db)
     return usage
 
-# Logs endpoint
+# Logs endpoints (keyset pagination: keyingi sahifa cursor i X-Next-Cursor sarlavhasida)
+def _logs_page(response: Response, db: Session, limit: int, cursor: Optional[str], **filters):
+    items, next_cursor = page_logs(db, limit, cursor, **filters)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return items
+
 @app.get("/logs/", response_model=List[dict])
 def read_logs(
+    response: Response,
+    action_type: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(default=100, ge=1, le=1000),
     db: Session = Depends(get_db),
     current_user: User = Depends(require_any_role([Role.ADMIN, Role.MANAGER]))
 ):
-    logs = db.query(Log).all()
-    return [{"action": log.action, "user_id": log.user_id, "details": log.details, "timestamp": log.timestamp} for log in logs]
+    action_types = [action_type] if action_type else None
+    return _logs_page(response, db, limit, cursor, action_types=action_types, since=since, until=until)
 
 @app.get("/logs/user/", response_model=List[dict])
 def read_user_logs(
+    response: Response,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(default=100, ge=1, le=1000),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    logs = db.query(Log).filter(Log.user_id == current_user.id).all()
-    return [{"action": log.action, "user_id": log.user_id, "details": log.details, "timestamp": log.timestamp} for log in logs]
+    return _logs_page(response, db, limit, cursor, user_id=current_user.id, since=since, until=until)
+
+@app.get("/logs/export/")
+def export_logs_ndjson(
+    action_type: Optional[str] = None,
+    user_id: Optional[int] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    current_user: User = Depends(require_any_role([Role.ADMIN, Role.MANAGER]))
+):
+    """All matching logs as NDJSON (one JSON object per line), streamed oldest first."""
+    action_types = [action_type] if action_type else None
+    return StreamingResponse(
+        export_logs(action_types=action_types, user_id=user_id, since=since, until=until),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="logs.ndjson"'}
+    )
 
 @app.get("/serve-meals/me/", response_model=List[dict])
 def read_user_meal_serves_me(
@@ -416,53 +479,49 @@ def read_user_meal_serves_me(
         for serve in meal_serves    
     ]
 
-@app.get("/reports/monthly/{year}/{month}/status/")
-async def get_monthly_report_status(
+@app.get("/reports/monthly/{year}/{month}/status/", response_model=TaskResponse)
+def get_monthly_report_status(
     year: int,
     month: int,
-    task_id: str,
+    task_id: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: User = Depends(require_any_role([Role.ADMIN, Role.MANAGER]))
 ):
-    task = AsyncResult(task_id)
+    _check_period(year, month)
+    if task_id is None:
+        version = data_version(db, year, month)
+        task_id = current_report_job(year, month, version) or report_task_id(year, month, version)
+        cached = get_cached_report(year, month, version)
+        if cached:
+            return {"task_id": task_id, "status": "SUCCESS", "result": cached}
+    task = AsyncResult(task_id, app=celery_app)
     if task.status == "SUCCESS":
-        result = task.result
-        return {"task_id": task_id, "status": task.status, "result": result}
+        return {"task_id": task_id, "status": task.status, "result": task.result}
     return {"task_id": task_id, "status": task.status, "result": None}
 
 @app.get("/logs/meal/", response_model=List[dict])
 def read_meal_logs(
+    response: Response,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(default=100, ge=1, le=1000),
     db: Session = Depends(get_db),
     current_user: User = Depends(require_any_role([Role.ADMIN, Role.MANAGER]))
 ):
-    logs = db.query(Log).filter(
-        Log.action.in_(["Ovqat yaratildi", "Ovqat yangilandi", "Ovqat o'chirildi"])
-    ).all()
-    return [
-        {
-            "action": log.action,
-            "user_id": log.user_id,
-            "details": log.details,
-            "timestamp": log.timestamp
-        } for log in logs
-    ]
+    return _logs_page(response, db, limit, cursor, action_types=["meal"], since=since, until=until)
 
 @app.get("/logs/ingredient/", response_model=List[dict])
 def read_ingredient_logs(
+    response: Response,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(default=100, ge=1, le=1000),
     db: Session = Depends(get_db),
     current_user: User = Depends(require_any_role([Role.ADMIN, Role.MANAGER]))
 ):
-    logs = db.query(Log).filter(
-        Log.action.in_(["Ingrediyent yaratildi", "Ingrediyent yangilandi", "Ingrediyent o'chirildi"])
-    ).all()
-    return [
-        {
-            "action": log.action,
-            "user_id": log.user_id,
-            "details": log.details,
-            "timestamp": log.timestamp
-        } for log in logs
-    ]
+    return _logs_page(response, db, limit, cursor, action_types=["ingredient"], since=since, until=until)
 
 @app.post("/tasks/check-ingredients/")
 async def trigger_ingredients_check(
@@ -481,4 +540,23 @@ async def get_task_status(
         "task_id": task_id,
         "status": task.status,
         "result": task.result if task.status == "SUCCESS" else None
-    }
\ No newline at end of file
+    }
+
+# Live kitchen dashboard (ombor va portsiyalar, 250 ms tick bilan)
+@app.websocket("/ws/kitchen")
+async def kitchen_dashboard(websocket: WebSocket, token: str = Query(...)):
+    db = SessionLocal()
+    try:
+        await get_current_user(token=token, db=db)
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+    finally:
+        db.close()
+
+    await manager.connect(websocket)
+    try:
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        manager.disconnect(websocket)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Enum, Float, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Enum, Float, Date, DateTime, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -53,10 +53,51 @@ class MealServe(Base):
     meal = relationship("Meal", back_populates="serves")
     user = relationship("User", back_populates="served_meals")
 
+# Log.action (erkin matn) -> action_type (filtrlash va indeks uchun)
+LOG_ACTION_TYPES = {
+    "Ingrediyent yaratildi": "ingredient",
+    "Ingrediyent yangilandi": "ingredient",
+    "Ingrediyent o'chirildi": "ingredient",
+    "Ovqat yaratildi": "meal",
+    "Ovqat yangilandi": "meal",
+    "Ovqat o'chirildi": "meal",
+    "Ovqat berildi": "serve",
+    "Stock Check": "stock",
+    "Stock Forecast": "stock",
+}
+LOG_ACTION_TYPE_OTHER = "other"
+
+
+def _log_action_type(context):
+    return LOG_ACTION_TYPES.get(context.get_current_parameters().get("action"), LOG_ACTION_TYPE_OTHER)
+
+
 class Log(Base):
     __tablename__ = "logs"
     id = Column(Integer, primary_key=True, index=True)
     action = Column(String, nullable=False)
+    # action dan avtomatik to'ldiriladi (executemany insert uchun ham)
+    action_type = Column(String, nullable=True, default=_log_action_type)
     user_id = Column(Integer, ForeignKey("users.id"))
     details = Column(String, nullable=True)
-    timestamp = Column(DateTime, default=datetime.utcnow)
\ No newline at end of file
+    timestamp = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_logs_action_type_timestamp", "action_type", "timestamp"),
+        Index("ix_logs_user_id_timestamp", "user_id", "timestamp"),
+    )
+
+class ServeVersion(Base):
+    # Oy bo'yicha meal_serves versiyasi ("YYYY-MM"), triggerlar orqali oshadi (hisobot keshi kaliti)
+    __tablename__ = "serve_versions"
+    period = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+class DailyMealServe(Base):
+    # Kunlik rollup: (kun, ovqat) bo'yicha berilgan portsiyalar, meal_serves triggerlari yangilaydi
+    __tablename__ = "daily_meal_serves"
+    date = Column(Date, primary_key=True)
+    meal_id = Column(Integer, primary_key=True)
+    portions = Column(Float, nullable=False, default=0.0)
+    serve_count = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,13 @@
+import redis
+
+# Celery broker bilan bir xil Redis (ogohlantirishlar holati, hisobot keshi)
+REDIS_URL = "redis://localhost:6379/0"
+
+_client = None
+
+
+def get_redis():
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(REDIS_URL)
+    return _client
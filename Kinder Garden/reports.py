@@ -0,0 +1,98 @@
+import json
+import uuid
+from sqlalchemy.orm import Session
+from models import ServeVersion
+from redis_client import get_redis
+
+# Oylik hisobot keshi.
+# serve_versions - har bir oy ("YYYY-MM") uchun versiya; meal_serves ga yozuv (insert/update/delete)
+# bo'lganda shu oyning versiyasi trigger orqali oshadi. Hisobot Redis da (year, month, version)
+# kaliti bilan saqlanadi: versiya o'zgarmagan bo'lsa (yopilgan o'tgan oylar deyarli doim) hisobot
+# task ishga tushirilmasdan keshdan qaytadi. Eski versiyalar REPORT_CACHE_TTL dan keyin o'chib ketadi.
+# Job har versiya uchun bir marta yuboriladi: uni yuborish huquqi SET NX EX bilan olinadi, job id shu
+# kalitda saqlanadi. Navbatdagi job ham PENDING ko'rinadi, shuning uchun status bo'yicha qaror qilinmaydi.
+# Muvaffaqiyatsiz job yangi id bilan qayta yuboriladi (eski id da FAILURE natijasi qoladi).
+
+REPORT_CACHE_TTL = 30 * 24 * 60 * 60
+# Job yo'qolib qolsa (worker xabarni olmay o'lsa), shu vaqtdan keyin qayta yuboriladi
+REPORT_JOB_TTL = 60 * 60
+
+_BUMP = """
+    INSERT INTO serve_versions (period, version) VALUES (strftime('%Y-%m', {row}.served_at), 1)
+    ON CONFLICT(period) DO UPDATE SET version = version + 1;
+"""
+
+_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS serve_versions_ai AFTER INSERT ON meal_serves BEGIN
+        {_BUMP.format(row="new")}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS serve_versions_au AFTER UPDATE ON meal_serves BEGIN
+        {_BUMP.format(row="old")}
+        {_BUMP.format(row="new")}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS serve_versions_ad AFTER DELETE ON meal_serves BEGIN
+        {_BUMP.format(row="old")}
+    END
+    """,
+]
+
+
+def init_report_versions(engine):
+    """Create the triggers (serve_versions itself is created by create_all)."""
+    with engine.begin() as conn:
+        for statement in _TRIGGERS:
+            conn.exec_driver_sql(statement)
+
+
+def data_version(db: Session, year: int, month: int) -> int:
+    version = db.query(ServeVersion.version).filter(ServeVersion.period == f"{year:04d}-{month:02d}").scalar()
+    return version or 0
+
+
+def report_task_id(year: int, month: int, version: int) -> str:
+    return f"monthly-report-{year:04d}-{month:02d}-v{version}"
+
+
+def _job_key(year: int, month: int, version: int) -> str:
+    return f"kitchen:report:{year:04d}-{month:02d}:v{version}:job"
+
+
+def current_report_job(year: int, month: int, version: int):
+    """Id of the job submitted for this data version, or None if none was submitted."""
+    job_id = get_redis().get(_job_key(year, month, version))
+    return job_id.decode() if job_id else None
+
+
+def claim_report_job(year: int, month: int, version: int, failed_job_id: str = None):
+    """
+    Claim the submission of a report job. Returns a new job id the caller must submit,
+    or None if another request already did. Pass failed_job_id to replace a failed job:
+    only one caller gets to resubmit it.
+    """
+    client = get_redis()
+    key = _job_key(year, month, version)
+    job_id = f"{report_task_id(year, month, version)}-{uuid.uuid4().hex[:8]}"
+    if failed_job_id is None:
+        return job_id if client.set(key, job_id, nx=True, ex=REPORT_JOB_TTL) else None
+    if not client.set(f"{key}:retry:{failed_job_id}", job_id, nx=True, ex=REPORT_JOB_TTL):
+        return None
+    client.set(key, job_id, ex=REPORT_JOB_TTL)
+    return job_id
+
+
+def _cache_key(year: int, month: int, version: int) -> str:
+    return f"kitchen:report:{year:04d}-{month:02d}:v{version}"
+
+
+def get_cached_report(year: int, month: int, version: int):
+    cached = get_redis().get(_cache_key(year, month, version))
+    return json.loads(cached) if cached else None
+
+
+def store_report(year: int, month: int, version: int, report: dict):
+    get_redis().set(_cache_key(year, month, version), json.dumps(report), ex=REPORT_CACHE_TTL)
@@ -0,0 +1,95 @@
+import argparse
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from database import SessionLocal, engine
+from models import Base
+
+# Kunlik serve rollup (daily_meal_serves).
+# meal_serves ga har bir yozuv (insert/update/delete) trigger orqali (kun, ovqat) qatoriga qo'shiladi
+# yoki ayiriladi - serve bilan bitta tranzaksiyada. Hisobotlar shu jadvaldan yig'iladi, shuning uchun
+# ularning narxi serve lar soniga emas, kunlar soniga bog'liq. Bo'shab qolgan qatorlar o'chiriladi.
+# Backfill: python rollup.py backfill
+
+_ADD = """
+    INSERT INTO daily_meal_serves (date, meal_id, portions, serve_count)
+    VALUES (date(new.served_at), new.meal_id, new.portions, 1)
+    ON CONFLICT(date, meal_id) DO UPDATE SET
+        portions = portions + excluded.portions,
+        serve_count = serve_count + 1;
+"""
+
+_SUBTRACT = """
+    UPDATE daily_meal_serves SET
+        portions = portions - old.portions,
+        serve_count = serve_count - 1
+    WHERE date = date(old.served_at) AND meal_id = old.meal_id;
+    DELETE FROM daily_meal_serves
+    WHERE date = date(old.served_at) AND meal_id = old.meal_id AND serve_count <= 0;
+"""
+
+_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS daily_meal_serves_ai AFTER INSERT ON meal_serves BEGIN
+        {_ADD}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS daily_meal_serves_au
+    AFTER UPDATE OF served_at, meal_id, portions ON meal_serves BEGIN
+        {_SUBTRACT}
+        {_ADD}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS daily_meal_serves_ad AFTER DELETE ON meal_serves BEGIN
+        {_SUBTRACT}
+    END
+    """,
+]
+
+_BACKFILL = """
+    INSERT INTO daily_meal_serves (date, meal_id, portions, serve_count)
+    SELECT date(served_at), meal_id, SUM(portions), COUNT(*)
+    FROM meal_serves
+    WHERE served_at IS NOT NULL
+    GROUP BY date(served_at), meal_id
+"""
+
+
+def init_daily_rollup(engine):
+    """
+    Create the triggers (the table is created by create_all).
+    The rollup is backfilled the first time the triggers are installed.
+    """
+    with engine.begin() as conn:
+        installed = conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'daily_meal_serves_ai'")
+        ).first()
+        for statement in _TRIGGERS:
+            conn.exec_driver_sql(statement)
+        if not installed:
+            conn.exec_driver_sql("DELETE FROM daily_meal_serves")
+            conn.exec_driver_sql(_BACKFILL)
+
+
+def backfill_daily_rollup(db: Session) -> int:
+    """Rebuild the rollup from meal_serves in one transaction. Returns the number of rollup rows."""
+    db.execute(text("DELETE FROM daily_meal_serves"))
+    db.execute(text(_BACKFILL))
+    rows = db.execute(text("SELECT COUNT(*) FROM daily_meal_serves")).scalar()
+    db.commit()
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="daily_meal_serves rollup jadvali")
+    parser.add_argument("command", choices=["backfill"])
+    parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    init_daily_rollup(engine)
+    db = SessionLocal()
+    try:
+        print(f"Rollup rows: {backfill_daily_rollup(db)}")
+    finally:
+        db.close()
@@ -1,7 +1,7 @@
 from pydantic import BaseModel
-from datetime import datetime
+from datetime import datetime, date
 from enum import Enum
-from typing import List, Optional, Any
+from typing import List, Optional, Any, Dict
 
 # Role enum
 class Role(str, Enum):
@@ -83,6 +83,9 @@ class MealServeCreate(BaseModel):
     class Config:
         from_attributes = True
 
+class MealServeBatch(BaseModel):
+    serves: List[MealServeCreate]
+
 class MealServe(BaseModel):
     id: int
     meal_id: int
@@ -100,6 +103,62 @@ class MealPortions(BaseModel):
     meal_name: str
     portions: int
 
+class MealCapacity(BaseModel):
+    meal_id: int
+    meal_name: Optional[str]
+    possible_portions: int
+    bottleneck_ingredient_id: Optional[int]
+    bottleneck_ingredient_name: Optional[str]
+    bottleneck_quantity: Optional[float]
+    required_per_portion: Optional[float]
+
+# Menu planning schemas
+class MenuPlanRequest(BaseModel):
+    # meal_id -> har bir kun uchun rejalashtirilgan portsiyalar
+    menu: Dict[int, List[float]]
+
+class PlannedIngredient(BaseModel):
+    ingredient_id: int
+    ingredient_name: str
+    quantity: float
+    minimum_quantity: float
+    required_total: float
+    required_per_day: List[float]
+    remaining_after_plan: float
+    below_minimum: bool
+
+class IngredientShortfall(BaseModel):
+    ingredient_id: int
+    ingredient_name: str
+    shortfall: float
+
+class DayShortfall(BaseModel):
+    day: int
+    ingredients: List[IngredientShortfall]
+
+class PurchaseItem(BaseModel):
+    ingredient_id: int
+    ingredient_name: str
+    quantity: float
+
+class MenuPlanResponse(BaseModel):
+    days: int
+    ingredients: List[PlannedIngredient]
+    shortfalls: List[DayShortfall]
+    purchase_list: List[PurchaseItem]
+
+# Forecast schema
+class IngredientForecast(BaseModel):
+    ingredient_id: int
+    ingredient_name: str
+    quantity: float
+    minimum_quantity: float
+    daily_consumption: float
+    days_left: Optional[float]
+    depletion_date: Optional[date]
+    days_to_minimum: Optional[float]
+    minimum_date: Optional[date]
+
 # Reports-related schemas
 class MonthlyReport(BaseModel):
     year: int
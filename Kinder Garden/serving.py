@@ -0,0 +1,119 @@
+from datetime import datetime
+from fastapi import HTTPException
+from sqlalchemy import update, case
+from sqlalchemy.orm import Session
+from models import Ingredient, Meal, MealIngredient, MealServe
+from audit import record_log
+
+# Ovqat berish (serve) pipeline.
+# Barcha ovqatlar uchun kerakli ingrediyentlar bitta so'rov bilan yig'iladi, ombor esa bitta
+# shartli UPDATE (quantity >= kerakli miqdor) bilan kamaytiriladi: hamma ingrediyent yetarli
+# bo'lsagina yangilanadi, aks holda rollback. Serve yozuvlari va audit log shu tranzaksiyada,
+# bitta commit bilan yoziladi. Minimumdan tushgan ingrediyentlar uchun bitta tekshiruv navbatga qo'yiladi.
+
+MAX_BATCH_SERVES = 100
+
+
+def _load_requirements(db: Session, serves):
+    """Meal names and the total amount needed per ingredient for all serves (one query)."""
+    meal_ids = {meal_id for meal_id, _ in serves}
+    rows = db.query(
+        Meal.id, Meal.name, MealIngredient.ingredient_id, MealIngredient.quantity
+    ).outerjoin(MealIngredient, MealIngredient.meal_id == Meal.id).filter(Meal.id.in_(meal_ids)).all()
+
+    meal_names, recipes = {}, {}
+    for meal_id, meal_name, ingredient_id, quantity in rows:
+        meal_names[meal_id] = meal_name
+        recipe = recipes.setdefault(meal_id, {})
+        if ingredient_id is not None:
+            recipe[ingredient_id] = recipe.get(ingredient_id, 0.0) + float(quantity)
+
+    missing = sorted(meal_ids - set(meal_names))
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Meal ID {missing[0]} not found")
+
+    required = {}
+    for meal_id, portions in serves:
+        for ingredient_id, quantity in recipes[meal_id].items():
+            required[ingredient_id] = required.get(ingredient_id, 0.0) + quantity * float(portions)
+    return meal_names, required
+
+
+def _insufficient_error(db: Session, required: dict) -> HTTPException:
+    stock = {row.id: row for row in db.query(Ingredient.id, Ingredient.name, Ingredient.quantity).filter(
+        Ingredient.id.in_(required)
+    )}
+    for ingredient_id in sorted(required):
+        ingredient = stock.get(ingredient_id)
+        if ingredient is None:
+            return HTTPException(status_code=404, detail=f"Ingredient ID {ingredient_id} not found")
+        if float(ingredient.quantity) < required[ingredient_id]:
+            return HTTPException(
+                status_code=400,
+                detail=f"Insufficient quantity of ingredient: {ingredient.name}. "
+                       f"Need {required[ingredient_id]}g, have {float(ingredient.quantity)}g"
+            )
+    # Shu orada boshqa serve omborni to'ldirgan - mijoz qayta urinishi mumkin
+    return HTTPException(status_code=409, detail="Stock changed during serve, please retry")
+
+
+def serve_meals(db: Session, serves, user_id: int, served_at: datetime = None):
+    """
+    Serve several meals in one transaction.
+
+    Args:
+        db (Session): Database session
+        serves (list): (meal_id, portions) pairs
+        user_id (int): User serving the meals
+
+    Returns (served, low_stock_ids): served holds one response dict per serve and
+    low_stock_ids the ingredients that dropped below minimum_quantity.
+    """
+    if not serves:
+        raise HTTPException(status_code=400, detail="Nothing to serve")
+    if len(serves) > MAX_BATCH_SERVES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_SERVES} serves per batch")
+    if any(portions <= 0 for _, portions in serves):
+        raise HTTPException(status_code=400, detail="Portions must be positive")
+
+    meal_names, required = _load_requirements(db, serves)
+    served_at = served_at or datetime.now()
+
+    low_stock_ids = []
+    if required:
+        amount = case(required, value=Ingredient.id)
+        updated = db.execute(
+            update(Ingredient)
+            .where(Ingredient.id.in_(required), Ingredient.quantity >= amount)
+            .values(quantity=Ingredient.quantity - amount)
+            .returning(Ingredient.id, Ingredient.quantity, Ingredient.minimum_quantity)
+            .execution_options(synchronize_session=False)
+        ).all()
+        if len(updated) != len(required):
+            db.rollback()
+            raise _insufficient_error(db, required)
+        low_stock_ids = sorted(row.id for row in updated if row.quantity < row.minimum_quantity)
+
+    db_serves = [
+        MealServe(meal_id=meal_id, user_id=user_id, served_at=served_at, portions=portions)
+        for meal_id, portions in serves
+    ]
+    db.add_all(db_serves)
+    for meal_id, portions in serves:
+        record_log(db, action="Ovqat berildi", user_id=user_id, details=f"Meal: {meal_names[meal_id]}, Portions: {portions}")
+    db.flush()
+
+    # Commit dan keyin atributlar expire bo'ladi - javob flush dan keyin tayyorlanadi
+    served = [
+        {
+            "id": serve.id,
+            "meal_id": serve.meal_id,
+            "meal_name": meal_names[serve.meal_id] or "Unknown meal",
+            "user_id": serve.user_id,
+            "served_at": serve.served_at,
+            "portions": serve.portions
+        }
+        for serve in db_serves
+    ]
+    db.commit()
+    return served, low_stock_ids
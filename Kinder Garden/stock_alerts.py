@@ -0,0 +1,133 @@
+import logging
+from datetime import datetime
+from redis.exceptions import RedisError
+from sqlalchemy.orm import Session
+from models import Ingredient, Log
+from redis_client import get_redis
+from forecast import forecast_depletion
+
+# Ombor ogohlantirishlari (low stock alert).
+# Serve va ingrediyent yangilanishi tekshiruvni darhol bajarmaydi: ingrediyent "dirty" to'plamiga
+# qo'shiladi va STOCK_CHECK_WINDOW ichida faqat bitta task navbatga qo'yiladi (debounce).
+# Task barcha dirty ingrediyentlarni bitta so'rov bilan tekshiradi. Ogohlantirilgan ingrediyentlar
+# ALERTED_KEY da saqlanadi: ombor minimumdan oshmaguncha shu ingrediyent uchun qayta log yozilmaydi.
+# To'liq tekshiruv (soatlik beat) prognozni ham ko'radi: FORECAST_ALERT_DAYS ichida minimumdan
+# tushishi kutilayotgan ingrediyentlar uchun oldindan "Stock Forecast" ogohlantirishi yoziladi.
+
+STOCK_CHECK_WINDOW = 30  # soniya
+DIRTY_KEY = "kitchen:stock:dirty"
+SCHEDULED_KEY = "kitchen:stock:scheduled"
+ALERTED_KEY = "kitchen:stock:alerted"
+FORECAST_ALERT_DAYS = 3
+FORECAST_ALERTED_KEY = "kitchen:stock:forecast_alerted"
+
+logger = logging.getLogger(__name__)
+
+
+def mark_dirty(ingredient_ids) -> bool:
+    """
+    Queue ingredients for the next batched check.
+    Returns True if the caller has to schedule the check task (none is pending yet).
+    Redis is unavailable: the error is logged and False returned (the hourly full check catches up).
+    """
+    try:
+        client = get_redis()
+        pipe = client.pipeline()
+        pipe.sadd(DIRTY_KEY, *ingredient_ids)
+        # Task yo'qolsa ham kalit abadiy qolib ketmasin
+        pipe.set(SCHEDULED_KEY, 1, nx=True, ex=STOCK_CHECK_WINDOW * 10)
+        _, scheduled = pipe.execute()
+    except RedisError:
+        logger.exception("Could not queue stock check for ingredients %s", list(ingredient_ids))
+        return False
+    return bool(scheduled)
+
+
+def take_dirty() -> list:
+    """Drain the dirty set. The scheduled flag is cleared first, so later marks schedule a new task."""
+    client = get_redis()
+    client.delete(SCHEDULED_KEY)
+    pipe = client.pipeline()
+    pipe.smembers(DIRTY_KEY)
+    pipe.delete(DIRTY_KEY)
+    members, _ = pipe.execute()
+    return sorted(int(member) for member in members)
+
+
+def check_stock(db: Session, ingredient_ids=None) -> list:
+    """
+    Log one alert per ingredient that dropped below minimum_quantity (one query).
+    ingredient_ids=None checks every ingredient. Returns names of newly alerted ingredients.
+    """
+    query = db.query(Ingredient.id, Ingredient.name, Ingredient.quantity, Ingredient.minimum_quantity)
+    if ingredient_ids is not None:
+        if not ingredient_ids:
+            return []
+        query = query.filter(Ingredient.id.in_(ingredient_ids))
+    rows = query.all()
+
+    low = [row for row in rows if row.quantity < row.minimum_quantity]
+    recovered = [row.id for row in rows if row.quantity >= row.minimum_quantity]
+
+    client = get_redis()
+    already = client.smismember(ALERTED_KEY, [row.id for row in low]) if low else []
+    new_alerts = [row for row, alerted in zip(low, already) if not alerted]
+
+    for row in new_alerts:
+        db.add(Log(
+            user_id=None,
+            action="Stock Check",
+            details=f"Low stock alert: {row.name} ({row.quantity}/{row.minimum_quantity})",
+            timestamp=datetime.utcnow()
+        ))
+    if new_alerts:
+        db.commit()
+
+    pipe = client.pipeline()
+    if new_alerts:
+        pipe.sadd(ALERTED_KEY, *[row.id for row in new_alerts])
+    if recovered:
+        pipe.srem(ALERTED_KEY, *recovered)
+    pipe.execute()
+    return [row.name for row in new_alerts]
+
+
+def check_forecast(db: Session, horizon_days: float = FORECAST_ALERT_DAYS) -> list:
+    """
+    Log one early warning per ingredient that is still above minimum_quantity but is
+    forecast to drop below it within horizon_days. Returns names of newly warned ingredients.
+    """
+    forecasts = forecast_depletion(db)
+    at_risk = [
+        item for item in forecasts
+        if item["days_to_minimum"] is not None
+        and item["quantity"] >= item["minimum_quantity"]
+        and item["days_to_minimum"] <= horizon_days
+    ]
+    risk_ids = {item["ingredient_id"] for item in at_risk}
+    safe = [item["ingredient_id"] for item in forecasts if item["ingredient_id"] not in risk_ids]
+
+    client = get_redis()
+    already = client.smismember(FORECAST_ALERTED_KEY, [item["ingredient_id"] for item in at_risk]) if at_risk else []
+    new_alerts = [item for item, alerted in zip(at_risk, already) if not alerted]
+
+    for item in new_alerts:
+        db.add(Log(
+            user_id=None,
+            action="Stock Forecast",
+            details=(
+                f"{item['ingredient_name']} expected below minimum on {item['minimum_date']} "
+                f"({item['daily_consumption']}/day, {item['quantity']}/{item['minimum_quantity']})"
+            ),
+            timestamp=datetime.utcnow()
+        ))
+    if new_alerts:
+        db.commit()
+
+    pipe = client.pipeline()
+    if new_alerts:
+        pipe.sadd(FORECAST_ALERTED_KEY, *[item["ingredient_id"] for item in new_alerts])
+    if safe:
+        pipe.srem(FORECAST_ALERTED_KEY, *safe)
+    pipe.execute()
+    return [item["ingredient_name"] for item in new_alerts]
@@ -1,9 +1,14 @@
+import logging
 from celery import Celery
 from database import SessionLocal
-from models import Ingredient, Log, MealServe, Meal
+from models import Ingredient, Log, MealServe, Meal, DailyMealServe
 from sqlalchemy.orm import Session, joinedload
-from datetime import datetime
+from datetime import datetime, date
 from sqlalchemy import func
+from reports import data_version, store_report
+from stock_alerts import check_stock, check_forecast, mark_dirty, take_dirty, STOCK_CHECK_WINDOW
+
+logger = logging.getLogger(__name__)
 
 # Configure Celery for Windows
 celery_app = Celery(
@@ -16,7 +21,6 @@ celery_app = Celery(
 # Celery Configuration
 celery_app.conf.update(
     worker_pool_restarts=True,
-    worker_max_tasks_per_child=1,
     task_track_started=True,
     task_serializer='json',
     accept_content=['json'],
@@ -36,39 +40,60 @@ def get_db():
             db.close()
 
 @celery_app.task
-def check_ingredients_quantity(ingredient_id: int):
-    """Check ingredient stock levels"""
+def check_ingredients_quantity(ingredient_ids=None):
+    """Check stock levels now: one ingredient id, a list of ids or every ingredient (None)"""
+    if isinstance(ingredient_ids, int):
+        ingredient_ids = [ingredient_ids]
     db = get_db()
     try:
-        ingredient = db.query(Ingredient).filter(Ingredient.id == ingredient_id).first()
-        if ingredient and ingredient.quantity < ingredient.minimum_quantity:
-            log_entry = Log(
-                user_id=None,
-                action="Stock Check",
-                details=f"Low stock alert: {ingredient.name} ({ingredient.quantity}/{ingredient.minimum_quantity})",
-                timestamp=datetime.utcnow()
-            )
-            db.add(log_entry)
-            db.commit()
-            return f"Alert logged for {ingredient.name}"
+        alerted = check_stock(db, ingredient_ids)
+        if ingredient_ids is None:
+            # To'liq tekshiruvda tugash prognozi bo'yicha oldindan ogohlantirish
+            alerted += [f"{name} (forecast)" for name in check_forecast(db)]
+        return f"Alert logged for {', '.join(alerted)}" if alerted else "No action needed"
+    finally:
+        db.close()
+
+@celery_app.task
+def check_dirty_ingredients():
+    """Check every ingredient marked dirty since the last run (one query per batch)"""
+    ingredient_ids = take_dirty()
+    if not ingredient_ids:
         return "No action needed"
+    db = get_db()
+    try:
+        alerted = check_stock(db, ingredient_ids)
+        return f"Alert logged for {', '.join(alerted)}" if alerted else "No action needed"
     finally:
         db.close()
 
+def schedule_stock_check(ingredient_ids):
+    """Debounced stock check: at most one pending task per STOCK_CHECK_WINDOW. Never raises."""
+    if not (ingredient_ids and mark_dirty(ingredient_ids)):
+        return
+    try:
+        check_dirty_ingredients.apply_async(countdown=STOCK_CHECK_WINDOW)
+    except Exception:
+        # Broker ishlamayapti: soatlik to'liq tekshiruv qolganini ko'radi
+        logger.exception("Could not schedule stock check task")
+
 @celery_app.task(bind=True)
 def generate_monthly_report(self, year: int, month: int):
     """Generate monthly report"""
     db = get_db()
     try:
-        start_date = datetime(year, month, 1)
-        end_date = datetime(year, month + 1, 1) if month < 12 else datetime(year + 1, 1, 1)
+        # Versiya hisobotdan oldin o'qiladi: shu orada serve qo'shilsa, kesh eski versiya ostida qoladi
+        version = data_version(db, year, month)
+        start_date = date(year, month, 1)
+        end_date = date(year, month + 1, 1) if month < 12 else date(year + 1, 1, 1)
+        # Kunlik rollup dan: oyning kunlari × ovqatlar qatorlari o'qiladi, alohida serve lar emas
         result = (
             db.query(
-                MealServe.meal_id,
-                func.sum(MealServe.portions).label("total_portions")
+                DailyMealServe.meal_id,
+                func.sum(DailyMealServe.portions).label("total_portions")
             )
-            .filter(MealServe.served_at >= start_date, MealServe.served_at < end_date)
-            .group_by(MealServe.meal_id)
+            .filter(DailyMealServe.date >= start_date, DailyMealServe.date < end_date)
+            .group_by(DailyMealServe.meal_id)
             .all()
         )
         
@@ -83,7 +108,7 @@ def generate_monthly_report(self, year: int, month: int):
         
         warning = "Low servings!" if total_served < total_possible * 0.1 else ""
         
-        return {
+        monthly_report = {
             "year": year,
             "month": month,
             "total_served": int(total_served),
@@ -91,6 +116,8 @@ def generate_monthly_report(self, year: int, month: int):
             "difference_percentage": round(difference_percentage, 2),
             "warning": warning
         }
+        store_report(year, month, version, monthly_report)
+        return monthly_report
     except Exception as e:
         self.retry(exc=e, countdown=5, max_retries=3)
     finally:
@@ -0,0 +1,116 @@
+import asyncio
+import json
+import threading
+from fastapi import WebSocket
+from starlette.concurrency import run_in_threadpool
+from typing import List
+from database import SessionLocal
+from capacity import load_recipe_matrix, compute_capacity
+
+# Oshxona dashboardi (WebSocket).
+# Endpointlar commit dan keyin mark_changed() chaqiradi - bu faqat bayroq qo'yadi (istalgan threaddan).
+# Ticker har TICK_SECONDS da bayroqni tekshiradi: o'zgarish bo'lsa ombor va portsiya sig'imi
+# (capacity.load_recipe_matrix - ikki so'rov) bir marta o'qiladi va oxirgi yuborilgan holatdan
+# farq qilgan qatorlargina barcha ulanishlarga bitta xabar bilan yuboriladi. Shu tick ichidagi
+# o'nlab serve lar bitta xabarga birlashadi. Yangi ulanishga avval to'liq "snapshot" yuboriladi.
+# Faqat shu jarayondagi o'zgarishlar ko'rinadi (Celery worker dagi yozuvlar keyingi o'zgarishda chiqadi).
+
+TICK_SECONDS = 0.25
+
+
+def load_snapshot() -> dict:
+    """Current stock and possible portions, keyed by id (two queries)."""
+    db = SessionLocal()
+    try:
+        matrix = load_recipe_matrix(db)
+    finally:
+        db.close()
+    portions, bottleneck = compute_capacity(matrix.recipe, matrix.stock)
+    ingredients = {
+        ingredient_id: {
+            "id": ingredient_id,
+            "name": matrix.ingredient_names[col],
+            "quantity": float(matrix.stock[col]),
+            "minimum_quantity": float(matrix.minimum[col]),
+            "low": bool(matrix.stock[col] < matrix.minimum[col]),
+        }
+        for col, ingredient_id in enumerate(matrix.ingredient_ids)
+    }
+    meals = {
+        meal_id: {
+            "meal_id": meal_id,
+            "meal_name": matrix.meal_names[row],
+            "possible_portions": int(portions[row]),
+            "bottleneck_ingredient_id": matrix.ingredient_ids[bottleneck[row]] if bottleneck[row] >= 0 else None,
+        }
+        for row, meal_id in enumerate(matrix.meal_ids)
+    }
+    return {"ingredients": ingredients, "portions": meals}
+
+
+def _diff(previous: dict, current: dict):
+    changed = [value for key, value in current.items() if previous.get(key) != value]
+    removed = [key for key in previous if key not in current]
+    return changed, removed
+
+
+class ConnectionManager:
+    def __init__(self):
+        self.active_connections: List[WebSocket] = []
+        self._changed = threading.Event()
+        self._ticker = None
+        self._last = None
+
+    async def connect(self, websocket: WebSocket):
+        await websocket.accept()
+        snapshot = await run_in_threadpool(load_snapshot)
+        await websocket.send_text(json.dumps({
+            "type": "snapshot",
+            "ingredients": list(snapshot["ingredients"].values()),
+            "portions": list(snapshot["portions"].values()),
+        }))
+        self.active_connections.append(websocket)
+        if self._last is None:
+            self._last = snapshot
+        if self._ticker is None or self._ticker.done():
+            self._ticker = asyncio.create_task(self._run())
+
+    def disconnect(self, websocket: WebSocket):
+        if websocket in self.active_connections:
+            self.active_connections.remove(websocket)
+
+    def mark_changed(self):
+        """Called after a commit that touched stock, recipes or meals; safe from any thread."""
+        self._changed.set()
+
+    async def send_message(self, message: str):
+        for connection in list(self.active_connections):
+            try:
+                await connection.send_text(message)
+            except Exception:
+                self.disconnect(connection)
+
+    async def _run(self):
+        while self.active_connections:
+            await asyncio.sleep(TICK_SECONDS)
+            if not self._changed.is_set():
+                continue
+            self._changed.clear()
+            snapshot = await run_in_threadpool(load_snapshot)
+            previous = self._last or {"ingredients": {}, "portions": {}}
+            self._last = snapshot
+            ingredients, removed_ingredients = _diff(previous["ingredients"], snapshot["ingredients"])
+            portions, removed_meals = _diff(previous["portions"], snapshot["portions"])
+            if ingredients or removed_ingredients or portions or removed_meals:
+                await self.send_message(json.dumps({
+                    "type": "update",
+                    "ingredients": ingredients,
+                    "removed_ingredients": removed_ingredients,
+                    "portions": portions,
+                    "removed_meals": removed_meals,
+                }))
+        # Hech kim ulanmagan - keyingi ulanish yangi snapshot dan boshlaydi
+        self._last = None
+
+
+manager = ConnectionManager()
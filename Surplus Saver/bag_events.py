@@ -0,0 +1,122 @@
+import asyncio
+import itertools
+import json
+import threading
+from typing import Optional
+from fastapi import Request
+from models import SurpriseBag, SurpriseBagResponse
+
+# Bag o‘zgarishlari oqimi (Server-Sent Events).
+# Endpointlar commit dan keyin publish_bag_event chaqiradi; har bir obunachining o‘z
+# chegaralangan navbati (queue) bor. Sekin obunachi navbati to‘lsa, eski hodisalar tashlanadi va
+# bitta "resync" hodisasi yuboriladi - mijoz katalogni qayta yuklaydi, boshqalar kutmaydi.
+# Hodisalar faqat shu jarayon ichida tarqatiladi (Celery dagi hold expiry bu yerga tushmaydi).
+
+QUEUE_SIZE = 100
+KEEPALIVE_SECONDS = 15.0
+
+
+class BagSubscriber:
+    def __init__(self, loop, price_min: Optional[float], price_max: Optional[float], store_name: Optional[str]):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.price_min = price_min
+        self.price_max = price_max
+        self.store_name = store_name.lower() if store_name else None
+
+    # get_surprise_bags dagi filtrlar bilan bir xil
+    def matches(self, bag: dict) -> bool:
+        if self.price_min is not None and bag["discount_price"] < self.price_min:
+            return False
+        if self.price_max is not None and bag["discount_price"] > self.price_max:
+            return False
+        if self.store_name and self.store_name not in (bag.get("store_name") or "").lower():
+            return False
+        return True
+
+    def offer(self, event: dict):
+        # Faqat event loop ichida chaqiriladi
+        if self.queue.full():
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"id": event["id"], "type": "resync", "bag": None})
+            return
+        self.queue.put_nowait(event)
+
+
+class BagEventBroker:
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    @property
+    def has_subscribers(self) -> bool:
+        return bool(self._subscribers)
+
+    def subscribe(self, subscriber: BagSubscriber):
+        with self._lock:
+            self._subscribers.add(subscriber)
+
+    def unsubscribe(self, subscriber: BagSubscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, event_type: str, bag: dict):
+        """Istalgan threaddan chaqirish mumkin (sync endpointlar thread pool da ishlaydi)."""
+        event = {"id": next(self._ids), "type": event_type, "bag": bag}
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            if subscriber.matches(bag):
+                try:
+                    subscriber.loop.call_soon_threadsafe(subscriber.offer, event)
+                except RuntimeError:
+                    # Loop yopilgan - obunachi endi yo‘q
+                    self.unsubscribe(subscriber)
+
+
+broker = BagEventBroker()
+
+
+def bag_payload(bag: SurpriseBag) -> Optional[dict]:
+    """Obunachi bo‘lmasa None - serializatsiya (va store yuklash) bekorga qilinmaydi."""
+    if not broker.has_subscribers:
+        return None
+    return SurpriseBagResponse.model_validate(bag).model_dump(mode="json")
+
+
+def publish_bag_event(bag: SurpriseBag, event_type: str = None):
+    """
+    Commit dan keyin chaqiriladi. event_type berilmasa, miqdorga qarab
+    "sold_out" yoki "quantity_changed" tanlanadi.
+    """
+    payload = bag_payload(bag)
+    if payload is None:
+        return
+    if event_type is None:
+        event_type = "sold_out" if bag.quantity <= 0 or bag.status == "sold" else "quantity_changed"
+    broker.publish(event_type, payload)
+
+
+def _format_sse(event: dict) -> str:
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event['bag'], ensure_ascii=False)}\n\n"
+
+
+async def stream_bag_events(request: Request, price_min: Optional[float], price_max: Optional[float], store_name: Optional[str]):
+    subscriber = BagSubscriber(asyncio.get_running_loop(), price_min, price_max, store_name)
+    broker.subscribe(subscriber)
+    try:
+        # Proxy lar bufferlamasligi uchun darhol bitta izoh yuboriladi
+        yield ": connected\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), timeout=KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    break
+                yield ": keep-alive\n\n"
+                continue
+            yield _format_sse(event)
+    finally:
+        broker.unsubscribe(subscriber)
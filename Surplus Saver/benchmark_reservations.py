@@ -0,0 +1,119 @@
+"""
+Bitta "issiq" bag uchun zaxira benchmarki.
+
+Bir nechta thread bir vaqtda bitta bag ga buyurtma beradi (reserve_stock +
+Order + OrderItem, bitta commit). Natijada sekundiga qabul qilingan buyurtmalar
+soni va ortiqcha sotilmaganligi tekshiriladi.
+
+    python benchmark_reservations.py --threads 16 --stock 2000
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from database import Base, enable_sqlite_pragmas
+from models import User, SurpriseBag, Order, OrderItem
+from reservations import reserve_stock, hold_expiry
+
+
+def setup(engine, stock: int, customers: int):
+    Session = sessionmaker(bind=engine)
+    db = Session()
+    store = User(name="Hot store", email="store@bench", phone="0", hashed_password="-", role="store")
+    db.add(store)
+    db.flush()
+    bag = SurpriseBag(
+        title="Flash drop", description="-", contents="-",
+        original_price=10.0, discount_price=5.0, quantity=stock, store_id=store.id
+    )
+    db.add(bag)
+    customer_ids = []
+    for i in range(customers):
+        customer = User(name=f"c{i}", email=f"c{i}@bench", phone=f"c{i}", hashed_password="-", role="customer", opening_balance=1e9)
+        db.add(customer)
+        db.flush()
+        customer_ids.append(customer.id)
+    db.commit()
+    bag_id = bag.id
+    db.close()
+    return bag_id, customer_ids
+
+
+def worker(Session, bag_id, customer_id, attempts, counters, lock):
+    accepted = rejected = busy = 0
+    for _ in range(attempts):
+        db = Session()
+        try:
+            if not reserve_stock(db, bag_id, 1):
+                db.rollback()
+                rejected += 1
+                continue
+            order = Order(customer_id=customer_id, status="pending", total_price=5.0,
+                          created_at=datetime.utcnow(), expires_at=hold_expiry())
+            db.add(order)
+            db.flush()
+            db.add(OrderItem(order_id=order.id, surprise_bag_id=bag_id, quantity=1, created_at=datetime.utcnow()))
+            db.commit()
+            accepted += 1
+        except OperationalError:
+            db.rollback()
+            busy += 1
+        finally:
+            db.close()
+    with lock:
+        counters["accepted"] += accepted
+        counters["rejected"] += rejected
+        counters["busy"] += busy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--stock", type=int, default=2000)
+    parser.add_argument("--attempts", type=int, default=200, help="har bir thread uchun urinishlar soni")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(
+            f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+            connect_args={"check_same_thread": False},
+            pool_size=args.threads,
+        )
+        enable_sqlite_pragmas(engine)
+        Base.metadata.create_all(bind=engine)
+        bag_id, customer_ids = setup(engine, args.stock, args.threads)
+        Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+        counters = {"accepted": 0, "rejected": 0, "busy": 0}
+        lock = threading.Lock()
+        threads = [
+            threading.Thread(target=worker, args=(Session, bag_id, customer_ids[i], args.attempts, counters, lock))
+            for i in range(args.threads)
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        db = Session()
+        remaining = db.get(SurpriseBag, bag_id).quantity
+        items = db.query(OrderItem).count()
+        db.close()
+        engine.dispose()
+
+    oversold = items + remaining != args.stock or remaining < 0
+    print(f"threads={args.threads} stock={args.stock} attempts={args.threads * args.attempts}")
+    print(f"accepted={counters['accepted']} rejected={counters['rejected']} busy={counters['busy']} remaining={remaining}")
+    print(f"elapsed={elapsed:.2f}s orders/sec={counters['accepted'] / elapsed:.0f}")
+    print("oversold: YES" if oversold else "oversold: no")
+
+
+if __name__ == "__main__":
+    main()
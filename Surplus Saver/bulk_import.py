@@ -0,0 +1,154 @@
+import csv
+import io
+import json
+from datetime import datetime
+from fastapi import HTTPException
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from models import SurpriseBag
+from expiry import resolve_pickup_window
+
+# Baglarni ommaviy import qilish (CSV yoki NDJSON).
+# Har bir qator create_surprise_bag bilan bir xil qoidalar (validate_new_bag) bo‘yicha tekshiriladi;
+# xato qatorlar o‘tkazib yuboriladi va raqami bilan qaytariladi. To‘g‘ri qatorlar INSERT_CHUNK_SIZE
+# bo‘laklarda executemany bilan, bitta tranzaksiyada yoziladi (FTS va statistika triggerlari o‘zi ishlaydi).
+
+IMPORT_FORMATS = ("csv", "ndjson")
+MAX_IMPORT_BYTES = 20 * 1024 * 1024
+MAX_IMPORT_ROWS = 50_000
+INSERT_CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+
+REQUIRED_FIELDS = ("title", "description", "contents", "original_price", "discount_price", "quantity")
+_TRUE = {"1", "true", "yes", "y", "on"}
+_FALSE = {"0", "false", "no", "n", "off"}
+
+
+def validate_new_bag(original_price: float, discount_price: float, quantity: int,
+                     pickup_start=None, pickup_end=None, expires_at=None):
+    """Yangi bag qoidalari (endpoint va import uchun umumiy). (pickup_start, pickup_end, expires_at) qaytaradi."""
+    if original_price <= 0:
+        raise HTTPException(status_code=400, detail="Original price must be positive")
+    if discount_price <= 0:
+        raise HTTPException(status_code=400, detail="Discount price must be positive")
+    if original_price <= discount_price:
+        raise HTTPException(status_code=400, detail="Original price must be greater than discount price")
+    if quantity < 0:
+        raise HTTPException(status_code=400, detail="Quantity cannot be negative")
+    return resolve_pickup_window(pickup_start, pickup_end, expires_at)
+
+
+def detect_format(requested: str, filename: str, content_type: str) -> str:
+    if requested:
+        if requested not in IMPORT_FORMATS:
+            raise HTTPException(status_code=400, detail=f"Format must be one of: {', '.join(IMPORT_FORMATS)}")
+        return requested
+    name = (filename or "").lower()
+    if name.endswith(".csv") or (content_type or "").startswith("text/csv"):
+        return "csv"
+    if name.endswith((".ndjson", ".jsonl")) or "ndjson" in (content_type or ""):
+        return "ndjson"
+    raise HTTPException(status_code=400, detail="Cannot detect file format, pass ?format=csv or ?format=ndjson")
+
+
+def _iter_rows(data: bytes, file_format: str):
+    """(qator raqami, dict yoki xato matni) juftliklari; raqam fayldagi ma’lumot qatori (1 dan)."""
+    text = data.decode("utf-8-sig")
+    if file_format == "csv":
+        for number, row in enumerate(csv.DictReader(io.StringIO(text)), start=1):
+            yield number, row
+        return
+    for number, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield number, f"Invalid JSON: {e}"
+            continue
+        yield number, row if isinstance(row, dict) else "Row must be a JSON object"
+
+
+def _parse_bool(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in _TRUE:
+        return True
+    if text in _FALSE:
+        return False
+    raise ValueError(f"is_active must be a boolean, got {value!r}")
+
+
+def _parse_datetime(value):
+    if value is None or value == "":
+        return None
+    return datetime.fromisoformat(str(value).strip())
+
+
+def _to_values(row: dict, store_id: int, now: datetime) -> dict:
+    missing = [field for field in REQUIRED_FIELDS if row.get(field) in (None, "")]
+    if missing:
+        raise ValueError(f"Missing fields: {', '.join(missing)}")
+    original_price = float(row["original_price"])
+    discount_price = float(row["discount_price"])
+    quantity = int(row["quantity"])
+    is_active = _parse_bool(row["is_active"]) if row.get("is_active") not in (None, "") else True
+    pickup_start, pickup_end, expires_at = validate_new_bag(
+        original_price, discount_price, quantity,
+        _parse_datetime(row.get("pickup_start")),
+        _parse_datetime(row.get("pickup_end")),
+        _parse_datetime(row.get("expires_at"))
+    )
+    return {
+        "title": str(row["title"]),
+        "description": str(row["description"]),
+        "contents": str(row["contents"]),
+        "original_price": original_price,
+        "discount_price": discount_price,
+        "quantity": quantity,
+        "is_active": is_active,
+        "store_id": store_id,
+        "status": "available" if quantity > 0 and is_active else "sold",
+        "pickup_start": pickup_start,
+        "pickup_end": pickup_end,
+        "expires_at": expires_at,
+        "created_at": now,
+    }
+
+
+def import_bags(db: Session, data: bytes, file_format: str, store_id: int) -> dict:
+    """
+    Faylni tekshirib, to‘g‘ri qatorlarni yozadi (commit chaqiruvchida).
+    {"imported": n, "failed": m, "errors": [{"row": raqam, "detail": "..."}]} qaytaradi.
+    """
+    if len(data) > MAX_IMPORT_BYTES:
+        raise HTTPException(status_code=413, detail=f"File is too large (max {MAX_IMPORT_BYTES // (1024 * 1024)} MB)")
+
+    now = datetime.utcnow()
+    valid, errors = [], []
+    failed = 0
+    try:
+        for number, row in _iter_rows(data, file_format):
+            if len(valid) + failed >= MAX_IMPORT_ROWS:
+                raise HTTPException(status_code=413, detail=f"Too many rows (max {MAX_IMPORT_ROWS})")
+            try:
+                if isinstance(row, str):
+                    raise ValueError(row)
+                valid.append(_to_values(row, store_id, now))
+            except HTTPException as e:
+                failed += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append({"row": number, "detail": e.detail})
+            except (ValueError, TypeError) as e:
+                failed += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append({"row": number, "detail": str(e)})
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"Cannot parse file: {e}")
+
+    # executemany: har bir bo‘lak bitta tayyorlangan INSERT bilan
+    for start in range(0, len(valid), INSERT_CHUNK_SIZE):
+        db.execute(insert(SurpriseBag), valid[start:start + INSERT_CHUNK_SIZE])
+
+    return {"imported": len(valid), "failed": failed, "errors": errors}
@@ -0,0 +1,108 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from fastapi import Request, Response
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import CatalogVersion
+
+# Katalog uchun shartli GET va javob keshi.
+# catalog_version - bitta qator, surprise_bags/orders/order_items ga har qanday yozuvda va do‘kon
+# nomi/joylashuvi o‘zgarganda (boshqa jarayonlardagi, masalan Celery dagi yozuvlar ham) trigger orqali oshadi.
+# Jarayon versiyani VERSION_TTL davomida xotirada ushlaydi, o‘zining commitidan keyin esa darhol
+# qayta o‘qiydi. ETag = versiya + so‘rov parametrlari; o‘zgarmagan so‘rov 304 yoki
+# LRU dagi tayyor body bilan qaytadi, SQLite ga murojaat qilinmaydi.
+
+VERSION_TTL = 1.0
+CACHE_SIZE = 256
+
+_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS catalog_version_{table}_{suffix} AFTER {operation} ON {table} BEGIN
+        UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+    END
+    """
+    for table in ("surprise_bags", "orders", "order_items")
+    for suffix, operation in (("ai", "INSERT"), ("au", "UPDATE"), ("ad", "DELETE"))
+] + [
+    # Do‘kon nomi (store_name filtri) va joylashuvi (yaqin atrof qidiruvi) ham katalogga ta’sir qiladi
+    """
+    CREATE TRIGGER IF NOT EXISTS catalog_version_users_au
+    AFTER UPDATE OF name, latitude, longitude ON users BEGIN
+        UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+    END
+    """
+]
+
+_lock = threading.Lock()
+_version = None
+_fetched_at = 0.0
+_bodies = OrderedDict()
+
+
+def init_catalog_version(engine):
+    with engine.begin() as conn:
+        conn.exec_driver_sql("INSERT OR IGNORE INTO catalog_version (id, version) VALUES (1, 0)")
+        for statement in _TRIGGERS:
+            conn.exec_driver_sql(statement)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _expire_version(session):
+    # Shu jarayondagi yozuv - keyingi so‘rov versiyani bazadan o‘qiydi
+    global _fetched_at
+    _fetched_at = 0.0
+
+
+def current_version(db: Session) -> int:
+    global _version, _fetched_at
+    now = time.monotonic()
+    with _lock:
+        if _version is not None and now - _fetched_at < VERSION_TTL:
+            return _version
+    version = db.query(CatalogVersion.version).filter(CatalogVersion.id == 1).scalar() or 0
+    with _lock:
+        _version, _fetched_at = version, now
+    return version
+
+
+def make_etag(version: int, request: Request, scope: str = "public") -> str:
+    params = "&".join(f"{key}={value}" for key, value in sorted(request.query_params.multi_items()))
+    digest = hashlib.sha1(f"{scope}|{request.url.path}?{params}".encode()).hexdigest()[:16]
+    return f'"{version}-{digest}"'
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    return header.strip() == "*" or etag in [tag.strip() for tag in header.split(",")]
+
+
+def cached_json_response(request: Request, db: Session, build, scope: str = "public") -> Response:
+    """
+    build() -> (json ga aylantiriladigan ma’lumot, qo‘shimcha headerlar) faqat kesh bo‘sh bo‘lganda chaqiriladi.
+    scope - javob kimga tegishli ekanligi (masalan "store:5"), ETag va kesh kalitiga qo‘shiladi.
+    """
+    etag = make_etag(current_version(db), request, scope)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    with _lock:
+        cached = _bodies.get(etag)
+        if cached is not None:
+            _bodies.move_to_end(etag)
+    if cached is None:
+        payload, extra_headers = build()
+        cached = (json.dumps(payload, ensure_ascii=False).encode(), extra_headers)
+        with _lock:
+            _bodies[etag] = cached
+            while len(_bodies) > CACHE_SIZE:
+                _bodies.popitem(last=False)
+
+    body, extra_headers = cached
+    return Response(content=body, media_type="application/json", headers={**extra_headers, **headers})
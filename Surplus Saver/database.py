@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -7,6 +7,21 @@ SQLALCHEMY_DATABASE_URL = "sqlite:///./surplus_saver.db"
 
 # Engine va session yaratish
 engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+
+
+# WAL: o‘quvchilar yozuvchini kutmaydi; busy_timeout: writer lock band bo‘lsa darhol xato emas, kutish
+def enable_sqlite_pragmas(engine):
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.close()
+
+
+enable_sqlite_pragmas(engine)
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 # Baza modellari uchun asos
@@ -18,4 +33,25 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+# Modeldan olib tashlangan (boshqasi bilan almashtirilgan) indekslar
+OBSOLETE_INDEXES = ["ix_surprise_bags_catalog_created", "ix_surprise_bags_catalog_price"]
+
+# create_all mavjud jadvallarga yangi ustun va indekslarni qo‘shmaydi,
+# shuning uchun ularni eski bazaga qo‘lda qo‘shib qo‘yamiz
+def sync_schema(engine):
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for index_name in OBSOLETE_INDEXES:
+            conn.exec_driver_sql(f"DROP INDEX IF EXISTS {index_name}")
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing_columns:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}")
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
@@ -0,0 +1,83 @@
+from datetime import datetime, timezone
+from fastapi import HTTPException
+from sqlalchemy import update, select, text
+from sqlalchemy.orm import Session, selectinload
+from models import SurpriseBag, OrderItem, Order
+from reservations import cancel_hold, release_order_lines
+
+# Tez buziladigan baglar muddati.
+# Bag da olib ketish oynasi (pickup_start - pickup_end) va expires_at bor (berilmasa pickup_end).
+# sweep_expired_bags (Celery beat) muddati o‘tgan baglarni partiyalab bitta UPDATE bilan
+# "expired" qiladi. "pending" buyurtmalardan faqat muddati o‘tgan bag itemlari chiqariladi (ombor va pul
+# qaytadi, buyurtma summasi kamayadi); buyurtmada boshqa item qolmasa, u butunlay bekor qilinadi.
+
+EXPIRY_BATCH_SIZE = 500
+
+# ix_surprise_bags_live_expires partial indeksining sharti bilan bir xil
+_EXPIRING_CONDITION = "surprise_bags.is_active = 1 AND surprise_bags.expires_at IS NOT NULL"
+
+
+def as_utc(value: datetime):
+    """Bazada vaqt UTC da, timezone siz saqlanadi."""
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def resolve_pickup_window(pickup_start, pickup_end, expires_at, now: datetime = None):
+    """Oynani tekshiradi va (pickup_start, pickup_end, expires_at) qaytaradi; noto‘g‘ri bo‘lsa 400."""
+    now = now or datetime.utcnow()
+    pickup_start, pickup_end, expires_at = as_utc(pickup_start), as_utc(pickup_end), as_utc(expires_at)
+    if pickup_start and pickup_end and pickup_start >= pickup_end:
+        raise HTTPException(status_code=400, detail="Pickup start must be before pickup end")
+    if expires_at is None:
+        expires_at = pickup_end
+    if expires_at is not None and expires_at <= now:
+        raise HTTPException(status_code=400, detail="Expiry time must be in the future")
+    return pickup_start, pickup_end, expires_at
+
+
+def bag_status(bag: SurpriseBag, now: datetime = None) -> str:
+    if bag.expires_at is not None and bag.expires_at <= (now or datetime.utcnow()):
+        return "expired"
+    return "available" if bag.quantity > 0 and bag.is_active else "sold"
+
+
+def sweep_expired_bags(db: Session, now: datetime = None, batch_size: int = EXPIRY_BATCH_SIZE) -> dict:
+    now = now or datetime.utcnow()
+    expired_bags = cancelled_holds = trimmed_holds = 0
+    while True:
+        batch = (
+            select(SurpriseBag.id)
+            .where(text(_EXPIRING_CONDITION), SurpriseBag.expires_at <= now)
+            .limit(batch_size)
+            .scalar_subquery()
+        )
+        bag_ids = db.execute(
+            update(SurpriseBag)
+            .where(SurpriseBag.id.in_(batch), SurpriseBag.is_active == True)
+            .values(is_active=False, status="expired")
+            .returning(SurpriseBag.id)
+            .execution_options(synchronize_session=False)
+        ).scalars().all()
+        if not bag_ids:
+            break
+
+        # Shu baglardagi zaxiralar itemlari bilan (ikki so‘rov), keyin har biri shartli bekor qilinadi
+        expired_ids = set(bag_ids)
+        held_orders = db.query(Order).options(selectinload(Order.items)).filter(
+            Order.id.in_(select(OrderItem.order_id).where(OrderItem.surprise_bag_id.in_(bag_ids))),
+            Order.status == "pending"
+        ).all()
+        for order in held_orders:
+            expired_items = [item for item in order.items if item.surprise_bag_id in expired_ids]
+            if len(expired_items) == len(order.items):
+                cancelled_holds += cancel_hold(db, order.id, "bag_expired")
+            elif release_order_lines(db, order, expired_items, "bag_expired"):
+                trimmed_holds += 1
+        db.commit()
+
+        expired_bags += len(bag_ids)
+        if len(bag_ids) < batch_size:
+            break
+    return {"expired_bags": expired_bags, "cancelled_holds": cancelled_holds, "trimmed_holds": trimmed_holds}
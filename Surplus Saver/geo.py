@@ -0,0 +1,91 @@
+import math
+import numpy as np
+from fastapi import HTTPException
+from sqlalchemy import and_, or_, values, column, Integer, Float
+from sqlalchemy.orm import Session
+from models import User
+
+# "Yaqin atrofdagi baglar" qidiruvi.
+# Har bir do‘kon koordinatasi CELL_SIZE_DEG o‘lchamli panjara katakchasiga (users.geo_cell) tushadi.
+# Qidiruv: radius atrofidagi kataklar - har bir kenglik qatori uchun bitta uzluksiz geo_cell oralig‘i
+# (indeks bo‘yicha) + aniq bounding box SQL da; keyin nomzodlar uchun haversine masofasi NumPy da
+# bitta vektorli amal bilan hisoblanadi. Natija (store_id, masofa) VALUES jadvali sifatida katalog
+# so‘roviga join qilinadi va masofa bo‘yicha keyset pagination qilinadi.
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 111.32
+CELL_SIZE_DEG = 0.1
+_LON_CELLS = int(round(360 / CELL_SIZE_DEG)) + 1
+
+DEFAULT_RADIUS_KM = 5.0
+MAX_RADIUS_KM = 50.0
+
+
+def validate_coordinates(latitude, longitude):
+    """Ikkalasi ham berilishi yoki ikkalasi ham bo‘sh bo‘lishi kerak; noto‘g‘ri bo‘lsa 400."""
+    if (latitude is None) != (longitude is None):
+        raise HTTPException(status_code=400, detail="Latitude and longitude must be provided together")
+    if latitude is not None and not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise HTTPException(status_code=400, detail="Coordinates are out of range")
+
+
+def _cell_index(latitude: float, longitude: float):
+    row = int(math.floor((latitude + 90) / CELL_SIZE_DEG))
+    col = int(math.floor((longitude + 180) / CELL_SIZE_DEG))
+    return row, col
+
+
+def grid_cell(latitude, longitude):
+    if latitude is None or longitude is None:
+        return None
+    row, col = _cell_index(latitude, longitude)
+    return row * _LON_CELLS + col
+
+
+def bounding_box(latitude: float, longitude: float, radius_km: float):
+    dlat = radius_km / KM_PER_DEGREE
+    cos_lat = math.cos(math.radians(latitude))
+    dlon = 180.0 if cos_lat < 1e-6 else min(180.0, radius_km / (KM_PER_DEGREE * cos_lat))
+    return (
+        max(-90.0, latitude - dlat), min(90.0, latitude + dlat),
+        max(-180.0, longitude - dlon), min(180.0, longitude + dlon)
+    )
+
+
+def haversine_km(latitude: float, longitude: float, latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+    lat1, lon1 = np.radians(latitude), np.radians(longitude)
+    lat2, lon2 = np.radians(latitudes), np.radians(longitudes)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def nearby_stores(db: Session, latitude: float, longitude: float, radius_km: float) -> dict:
+    """Radius ichidagi do‘konlar: {store_id: masofa_km}."""
+    min_lat, max_lat, min_lon, max_lon = bounding_box(latitude, longitude, radius_km)
+    low_row, low_col = _cell_index(min_lat, min_lon)
+    high_row, high_col = _cell_index(max_lat, max_lon)
+    cell_ranges = [
+        User.geo_cell.between(row * _LON_CELLS + low_col, row * _LON_CELLS + high_col)
+        for row in range(low_row, high_row + 1)
+    ]
+    candidates = db.query(User.id, User.latitude, User.longitude).filter(
+        User.role == "store",
+        or_(*cell_ranges),
+        and_(User.latitude.between(min_lat, max_lat), User.longitude.between(min_lon, max_lon))
+    ).all()
+    if not candidates:
+        return {}
+
+    ids = np.fromiter((row[0] for row in candidates), dtype=np.int64, count=len(candidates))
+    coordinates = np.array([(row[1], row[2]) for row in candidates], dtype=np.float64)
+    distances = haversine_km(latitude, longitude, coordinates[:, 0], coordinates[:, 1])
+    inside = distances <= radius_km
+    return dict(zip(ids[inside].tolist(), distances[inside].tolist()))
+
+
+def distance_table(distances: dict):
+    """{store_id: masofa} ni so‘rovga join qilinadigan CTE ga (WITH nearby_stores(...) AS (VALUES ...)) aylantiradi."""
+    return values(
+        column("store_id", Integer), column("distance", Float),
+        name="nearby_stores", literal_binds=True
+    ).data(list(distances.items())).cte("nearby_stores")
@@ -0,0 +1,80 @@
+from datetime import datetime
+from sqlalchemy import func, text
+from sqlalchemy.orm import Session
+from models import User, BalanceEntry, BalanceSnapshot
+
+# Balans ledger.
+# Balans o‘zgarishi - bu balance_entries ga yangi qator (insert-only); users qatori
+# yangilanmaydi, shuning uchun mashhur do‘konning qatori "issiq" nuqtaga aylanmaydi.
+# Joriy balans = oxirgi snapshot + snapshotdan keyingi yozuvlar.
+# compact_balances fon vazifasi yangi snapshot yozib, qo‘shiladigan yozuvlarni kam ushlaydi.
+
+
+def post_entry(db: Session, user_id: int, amount: float, reason: str, order_id: int = None) -> BalanceEntry:
+    entry = BalanceEntry(
+        user_id=user_id,
+        amount=amount,
+        reason=reason,
+        order_id=order_id,
+        created_at=datetime.utcnow()
+    )
+    db.add(entry)
+    return entry
+
+
+def get_balance(db: Session, user: User) -> float:
+    if db is None:
+        return user.opening_balance or 0.0
+    snapshot = db.query(BalanceSnapshot.balance, BalanceSnapshot.last_entry_id).filter(
+        BalanceSnapshot.user_id == user.id
+    ).order_by(BalanceSnapshot.last_entry_id.desc()).first()
+    if snapshot:
+        base, last_entry_id = snapshot
+    else:
+        base, last_entry_id = user.opening_balance or 0.0, 0
+
+    since_snapshot = db.query(func.coalesce(func.sum(BalanceEntry.amount), 0.0)).filter(
+        BalanceEntry.user_id == user.id,
+        BalanceEntry.id > last_entry_id
+    ).scalar()
+    return base + since_snapshot
+
+
+# Har bir foydalanuvchining oxirgi snapshoti
+_LATEST_SNAPSHOTS = """
+    SELECT s.user_id, s.balance, s.last_entry_id
+    FROM balance_snapshots s
+    WHERE s.last_entry_id = (
+        SELECT MAX(last_entry_id) FROM balance_snapshots WHERE user_id = s.user_id
+    )
+"""
+
+
+def compact_balances(db: Session) -> int:
+    """
+    Snapshotdan keyin yozuvi bor har bir foydalanuvchi uchun yangi snapshot yozadi
+    (bitta INSERT ... SELECT), eskirgan snapshotlarni o‘chiradi. Yangi snapshotlar sonini qaytaradi.
+    """
+    created = db.execute(text(f"""
+        INSERT INTO balance_snapshots (user_id, balance, last_entry_id, created_at)
+        SELECT e.user_id,
+               COALESCE(latest.balance, u.balance, 0) + SUM(e.amount),
+               MAX(e.id),
+               :now
+        FROM balance_entries e
+        JOIN users u ON u.id = e.user_id
+        LEFT JOIN ({_LATEST_SNAPSHOTS}) latest ON latest.user_id = e.user_id
+        WHERE e.id > COALESCE(latest.last_entry_id, 0)
+        GROUP BY e.user_id
+    """), {"now": datetime.utcnow()}).rowcount
+
+    db.execute(text(f"""
+        DELETE FROM balance_snapshots
+        WHERE id NOT IN (
+            SELECT s.id FROM balance_snapshots s
+            JOIN ({_LATEST_SNAPSHOTS}) latest
+              ON latest.user_id = s.user_id AND latest.last_entry_id = s.last_entry_id
+        )
+    """))
+    db.commit()
+    return created
@@ -0,0 +1,49 @@
+from sqlalchemy.orm import Session, selectinload, contains_eager
+from models import SurpriseBag, Order, OrderItem
+
+# Eager loading: javob uchun kerakli bog‘lanishlar oldindan yuklanadi,
+# shunda har bir qator uchun alohida SurpriseBag / User so‘rovi bajarilmaydi.
+
+
+def joined_bag_options():
+    """So‘rovda User allaqachon join qilingan bo‘lsa, shu join dan foydalanish."""
+    return (contains_eager(SurpriseBag.store),)
+
+
+def order_options():
+    """Order -> items -> surprise_bag -> store: jami 2 ta so‘rov."""
+    return (
+        selectinload(Order.items)
+        .joinedload(OrderItem.surprise_bag)
+        .joinedload(SurpriseBag.store),
+    )
+
+
+def load_order(db: Session, order_id: int):
+    """Buyurtmani barcha itemlari bilan qayta yuklash (commit dan keyin javob uchun)."""
+    return (
+        db.query(Order)
+        .options(*order_options())
+        .populate_existing()
+        .filter(Order.id == order_id)
+        .first()
+    )
+
+
+def load_store_orders(db: Session, store_id: int):
+    """Do‘kon buyurtmalari, faqat shu do‘konning itemlari bilan, bitta so‘rovda."""
+    return (
+        db.query(Order)
+        .join(Order.items)
+        .join(OrderItem.surprise_bag)
+        .join(SurpriseBag.store)
+        .filter(SurpriseBag.store_id == store_id)
+        .options(
+            contains_eager(Order.items)
+            .contains_eager(OrderItem.surprise_bag)
+            .contains_eager(SurpriseBag.store)
+        )
+        .populate_existing()
+        .order_by(Order.id, OrderItem.id)
+        .all()
+    )
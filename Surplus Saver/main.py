@@ -1,24 +1,42 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Form, File, UploadFile
+from fastapi import FastAPI, Depends, HTTPException, status, Form, File, UploadFile, Query, Request, BackgroundTasks
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from sqlalchemy import text, or_
 from sqlalchemy.orm import Session
-from database import SessionLocal, engine, Base, get_db
-from models import User, SurpriseBag, Order, OrderItem, UserResponse, UserCreate, UserUpdate, SurpriseBagResponse, SurpriseBagCreate, SurpriseBagUpdate, OrderResponse, OrderItemResponse, OrderCreate, Token
+from database import SessionLocal, engine, Base, get_db, sync_schema
+from models import LIVE_BAG_CONDITION, User, SurpriseBag, Order, OrderItem, UserResponse, UserCreate, UserUpdate, SurpriseBagResponse, SurpriseBagCreate, SurpriseBagUpdate, OrderResponse, OrderItemResponse, OrderCreate, Token
 from pydantic import BaseModel, validator
 from passlib.context import CryptContext
 from auth import create_access_token, get_current_user, get_current_store, get_current_customer
+from search import init_search_index, search_matches
+from stats import init_store_stats, load_store_stats
+from catalog_cache import init_catalog_version, cached_json_response
+from bag_events import broker, bag_payload, publish_bag_event, stream_bag_events
+from loaders import joined_bag_options, order_options, load_order, load_store_orders
+from ledger import post_entry
+from outbox import notify
+from orders import add_order_item, backfill_unit_prices
+from reservations import reserve_stock, release_items, hold_expiry
+from expiry import resolve_pickup_window, bag_status
+from geo import DEFAULT_RADIUS_KM, MAX_RADIUS_KM, validate_coordinates, grid_cell, nearby_stores, distance_table
+from bulk_import import MAX_IMPORT_BYTES, validate_new_bag, detect_format, import_bags
+from uploads import (
+    TMP_DIR, ImmutableStaticFiles, save_upload, release_image, purge_unreferenced_image,
+    generate_thumbnails, shutdown_process_pool
+)
+from pagination import SORT_OPTIONS, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, paginate, order_by_sort
 from datetime import timedelta, datetime
 from typing import Optional, List
 import os
 import uuid
-from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
 
 app = FastAPI()
 
-# Static fayllar uchun direktoriya
-UPLOAD_DIR = "static/uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Static fayllar uchun direktoriya (content-addressed rasmlar uzoq muddat keshlanadi)
+os.makedirs(TMP_DIR, exist_ok=True)
+app.mount("/static", ImmutableStaticFiles(directory="static"), name="static")
 
 # CORS sozlamalari
 app.add_middleware(
@@ -27,10 +45,21 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
 # Ma’lumotlar bazasini yaratish
 Base.metadata.create_all(bind=engine)
+sync_schema(engine)
+backfill_unit_prices(engine)
+init_search_index(engine)
+init_store_stats(engine)
+init_catalog_version(engine)
+
+# Thumbnail process pool ni to‘xtatish
+@app.on_event("shutdown")
+def shutdown_event():
+    shutdown_process_pool()
 
 # Parolni shifrlash uchun Passlib konteksti
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -48,6 +77,7 @@ def register_user(user: UserCreate, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail="Role must be 'store' or 'customer'")
     if user.balance < 0:
         raise HTTPException(status_code=400, detail="Balance cannot be negative")
+    validate_coordinates(user.latitude, user.longitude)
     
     hashed_password = pwd_context.hash(user.password)
     new_user = User(
@@ -56,7 +86,10 @@ def register_user(user: UserCreate, db: Session = Depends(get_db)):
         phone=user.phone,
         hashed_password=hashed_password,
         role=user.role,
-        balance=user.balance,
+        opening_balance=user.balance,
+        latitude=user.latitude,
+        longitude=user.longitude,
+        geo_cell=grid_cell(user.latitude, user.longitude),
         created_at=datetime.utcnow()
     )
     db.add(new_user)
@@ -84,7 +117,8 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
 
 # “Surprise Bag” qo‘shish
 @app.post("/surprise-bags/", response_model=SurpriseBagResponse)
-async def create_surprise_bag(
+def create_surprise_bag(
+    background_tasks: BackgroundTasks,
     title: str = Form(...),
     description: str = Form(...),
     contents: str = Form(...),
@@ -92,32 +126,25 @@ async def create_surprise_bag(
     discount_price: float = Form(...),
     quantity: int = Form(...),
     is_active: bool = Form(True),
+    pickup_start: datetime = Form(None),
+    pickup_end: datetime = Form(None),
+    expires_at: datetime = Form(None),
     image: UploadFile = File(None),
     current_user: User = Depends(get_current_store),
     db: Session = Depends(get_db)
 ):
-    # Validatsiya
-    if original_price <= 0:
-        raise HTTPException(status_code=400, detail="Original price must be positive")
-    if discount_price <= 0:
-        raise HTTPException(status_code=400, detail="Discount price must be positive")
-    if original_price <= discount_price:
-        raise HTTPException(status_code=400, detail="Original price must be greater than discount price")
-    if quantity < 0:
-        raise HTTPException(status_code=400, detail="Quantity cannot be negative")
-
-    # Rasmni saqlash (agar yuborilgan bo‘lsa)
+    # Validatsiya (ommaviy import bilan bir xil qoidalar)
+    pickup_start, pickup_end, expires_at = validate_new_bag(
+        original_price, discount_price, quantity, pickup_start, pickup_end, expires_at
+    )
+
+    # Rasmni saqlash (agar yuborilgan bo‘lsa): bo‘laklab, hajmi cheklangan, hash bo‘yicha dedup
     image_url = None
+    thumbnail_widths = None
     if image:
-        file_extension = image.filename.split(".")[-1]
-        filename = f"{uuid.uuid4()}.{file_extension}"
-        file_path = os.path.join(UPLOAD_DIR, filename)
-        
-        with open(file_path, "wb") as f:
-            content = await image.read()
-            f.write(content)
-        
-        image_url = f"/{file_path}"
+        stored_image = save_upload(db, image)
+        image_url = stored_image.url
+        thumbnail_widths = stored_image.thumbnail_widths
 
     # SurpriseBag yaratish
     db_bag = SurpriseBag(
@@ -131,20 +158,52 @@ async def create_surprise_bag(
         store_id=current_user.id,
         status="available" if quantity > 0 and is_active else "sold",
         image_url=image_url,
+        thumbnail_widths=thumbnail_widths,
+        pickup_start=pickup_start,
+        pickup_end=pickup_end,
+        expires_at=expires_at,
         created_at=datetime.utcnow()
     )
     db.add(db_bag)
+    db.flush()
+    notify(db, f"bag:{db_bag.id}:created:{uuid.uuid4().hex}", f"Surprise Bag {db_bag.id} created by store {current_user.id}.")
     db.commit()
     db.refresh(db_bag)
 
-    print(f"Notification: Surprise Bag {db_bag.id} created by store {current_user.id}.")
+    # Thumbnaillar javobdan keyin process pool da yasaladi (rasm oldin yuklangan bo‘lsa tayyor)
+    if image_url and not thumbnail_widths:
+        background_tasks.add_task(generate_thumbnails, db_bag.id, image_url)
+
+    publish_bag_event(db_bag, "created")
     
     return db_bag
 
+# Baglarni ommaviy import qilish (CSV yoki NDJSON): xato qatorlar raqami bilan qaytariladi
+@app.post("/surprise-bags/import/")
+async def import_surprise_bags(
+    file: UploadFile = File(...),
+    requested_format: Optional[str] = Query(None, alias="format"),
+    current_user: User = Depends(get_current_store),
+    db: Session = Depends(get_db)
+):
+    file_format = detect_format(requested_format, file.filename, file.content_type)
+    data = await file.read(MAX_IMPORT_BYTES + 1)
+
+    # Tahlil va yozish thread pool da: katta fayl event loop ni to‘xtatmaydi
+    def run_import():
+        result = import_bags(db, data, file_format, current_user.id)
+        if result["imported"]:
+            notify(db, f"import:{uuid.uuid4().hex}", f"Store {current_user.id} imported {result['imported']} Surprise Bags.")
+        db.commit()
+        return result
+
+    return await run_in_threadpool(run_import)
+
 # “Surprise Bag”ni yangilash
 @app.put("/surprise-bags/{bag_id}/", response_model=SurpriseBagResponse)
-async def update_surprise_bag(
+def update_surprise_bag(
     bag_id: int,
+    background_tasks: BackgroundTasks,
     title: str = Form(None),
     description: str = Form(None),
     contents: str = Form(None),
@@ -152,6 +211,9 @@ async def update_surprise_bag(
     discount_price: float = Form(None),
     quantity: int = Form(None),
     is_active: bool = Form(None),
+    pickup_start: datetime = Form(None),
+    pickup_end: datetime = Form(None),
+    expires_at: datetime = Form(None),
     image: UploadFile = File(None),
     current_user: User = Depends(get_current_store),
     db: Session = Depends(get_db)
@@ -167,7 +229,8 @@ async def update_surprise_bag(
     # Agar hech qanday yangilanish bo‘lmasa
     if not any([title, description, contents, original_price is not None, 
                 discount_price is not None, quantity is not None, 
-                is_active is not None, image is not None]):
+                is_active is not None, image is not None, pickup_start is not None,
+                pickup_end is not None, expires_at is not None]):
         raise HTTPException(status_code=400, detail="At least one field must be provided to update")
 
     # Yangilanishlarni amalga oshirish
@@ -192,24 +255,14 @@ async def update_surprise_bag(
     if is_active is not None:
         db_bag.is_active = is_active
 
-    # Rasmni yangilash (agar yuborilgan bo‘lsa)
-    if image:
-        # Eski rasmni o‘chirish (agar mavjud bo‘lsa)
-        if db_bag.image_url:
-            old_file_path = db_bag.image_url.lstrip("/")
-            if os.path.exists(old_file_path):
-                os.remove(old_file_path)
-
-        # Yangi rasmni saqlash
-        file_extension = image.filename.split(".")[-1]
-        filename = f"{uuid.uuid4()}.{file_extension}"
-        file_path = os.path.join(UPLOAD_DIR, filename)
-        
-        with open(file_path, "wb") as f:
-            content = await image.read()
-            f.write(content)
-        
-        db_bag.image_url = f"/{file_path}"
+    # Olib ketish oynasi: berilmagan chegaralar joriy qiymatdan olinadi
+    if pickup_start is not None or pickup_end is not None or expires_at is not None:
+        db_bag.pickup_start, db_bag.pickup_end, db_bag.expires_at = resolve_pickup_window(
+            pickup_start if pickup_start is not None else db_bag.pickup_start,
+            pickup_end if pickup_end is not None else db_bag.pickup_end,
+            # yangi pickup_end berilsa, expires_at (berilmagan bo‘lsa) unga tenglashadi
+            expires_at if expires_at is not None or pickup_end is not None else db_bag.expires_at
+        )
 
     # Original price va discount price o‘zaro mosligini tekshirish
     if (original_price is not None or discount_price is not None):
@@ -218,13 +271,34 @@ async def update_surprise_bag(
         if discount_price_val >= original_price_val:
             raise HTTPException(status_code=400, detail="Original price must be greater than discount price")
 
-    # Statusni yangilash
-    db_bag.status = "available" if db_bag.quantity > 0 and db_bag.is_active else "sold"
-
+    # Rasmni yangilash (agar yuborilgan bo‘lsa)
+    old_image_url = None
+    if image:
+        # Yangi rasmni saqlash, eskisining ref_count ini kamaytirish
+        stored_image = save_upload(db, image)
+        if db_bag.image_url != stored_image.url:
+            old_image_url = db_bag.image_url
+            release_image(db, old_image_url)
+        else:
+            # Xuddi shu rasm qayta yuklandi: ortiqcha ref ni qaytarish
+            release_image(db, stored_image.url)
+        db_bag.image_url = stored_image.url
+        db_bag.thumbnail_widths = stored_image.thumbnail_widths
+
+    # Statusni yangilash (muddati o‘tgan bag "expired" bo‘lib qoladi)
+    db_bag.status = bag_status(db_bag)
+
+    notify(db, f"bag:{db_bag.id}:updated:{uuid.uuid4().hex}", f"Surprise Bag {db_bag.id} updated by store {current_user.id}.")
     db.commit()
     db.refresh(db_bag)
 
-    print(f"Notification: Surprise Bag {db_bag.id} updated by store {current_user.id}.")
+    # Eski rasmga boshqa hech kim ishora qilmasa, faylni o‘chirish
+    if old_image_url:
+        purge_unreferenced_image(db, old_image_url)
+    if image and not db_bag.thumbnail_widths:
+        background_tasks.add_task(generate_thumbnails, db_bag.id, db_bag.image_url)
+
+    publish_bag_event(db_bag, "sold_out" if db_bag.status == "sold" else "updated")
     
     return db_bag
 
@@ -239,31 +313,54 @@ def delete_surprise_bag(
     if not db_bag:
         raise HTTPException(status_code=404, detail="Surprise Bag not found or not yours")
     
-    # Agar rasm mavjud bo‘lsa, uni o‘chirish
-    if db_bag.image_url:
-        file_path = db_bag.image_url.lstrip("/")
-        if os.path.exists(file_path):
-            os.remove(file_path)
-    
+    # Rasmga boshqa bag ishora qilmasa, uni thumbnaillari bilan o‘chirish
+    image_url = db_bag.image_url
+    deleted_bag = bag_payload(db_bag)
+    release_image(db, image_url)
     db.delete(db_bag)
+    notify(db, f"bag:{bag_id}:deleted:{uuid.uuid4().hex}", f"Surprise Bag {bag_id} deleted by store {current_user.id}.")
     db.commit()
-    
-    print(f"Notification: Surprise Bag {bag_id} deleted by store {current_user.id}.")
+    purge_unreferenced_image(db, image_url)
+    if deleted_bag:
+        broker.publish("deleted", deleted_bag)
     
     return {"message": "Surprise Bag deleted successfully"}
 
 # “Surprise Bag” ro‘yxatini ko‘rish
 @app.get("/surprise-bags/", response_model=List[SurpriseBagResponse])
 def get_surprise_bags(
+    request: Request,
     price_min: Optional[float] = None,
     price_max: Optional[float] = None,
     store_name: Optional[str] = None,
     search: Optional[str] = None,
+    sort: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    lat: Optional[float] = None,
+    lon: Optional[float] = None,
+    radius_km: float = Query(DEFAULT_RADIUS_KM, gt=0, le=MAX_RADIUS_KM),
     db: Session = Depends(get_db)
 ):
-    query = db.query(SurpriseBag).join(User, SurpriseBag.store_id == User.id).filter(
-        SurpriseBag.status == "available",
-        SurpriseBag.is_active == True
+    if sort is not None and sort not in SORT_OPTIONS and sort not in ("relevance", "distance"):
+        raise HTTPException(status_code=400, detail=f"Sort must be one of: relevance, distance, {', '.join(SORT_OPTIONS)}")
+    validate_coordinates(lat, lon)
+    if sort == "distance" and lat is None:
+        raise HTTPException(status_code=400, detail="Sort by distance requires lat and lon")
+
+    # Katalog o‘zgarmagan bo‘lsa 304 yoki keshdagi body, bazaga so‘rov yuborilmaydi
+    return cached_json_response(
+        request, db,
+        lambda: _build_catalog_page(db, price_min, price_max, store_name, search, sort, cursor, limit, lat, lon, radius_km)
+    )
+
+
+def _build_catalog_page(db, price_min, price_max, store_name, search, sort, cursor, limit, lat, lon, radius_km):
+    # Shart literal holda: SQLite faqat shunda ix_surprise_bags_live_* partial indekslarini ishlatadi.
+    # Sweeper hali yetib kelmagan muddati o‘tgan baglar ham ko‘rsatilmaydi.
+    query = db.query(SurpriseBag).join(SurpriseBag.store).options(*joined_bag_options()).filter(
+        text(LIVE_BAG_CONDITION),
+        or_(SurpriseBag.expires_at == None, SurpriseBag.expires_at > datetime.utcnow())
     )
 
     # Narx bo‘yicha filtrlash
@@ -276,24 +373,54 @@ def get_surprise_bags(
     if store_name:
         query = query.filter(User.name.ilike(f"%{store_name}%"))
 
-    # Kalit so‘z bo‘yicha qidirish
-    if search:
-        search_term = f"%{search}%"
-        query = query.filter(
-            or_(
-                SurpriseBag.title.ilike(search_term),
-                SurpriseBag.description.ilike(search_term),
-                SurpriseBag.contents.ilike(search_term)
-            )
-        )
-
-    bags = query.all()
-
-    # Har bir SurpriseBag uchun store_name ni qo‘shish
-    for bag in bags:
-        bag.store_name = db.query(User).filter(User.id == bag.store_id).first().name
-
-    return bags
+    # Yaqin atrofdagi do‘konlar (panjara indeksi + vektorli haversine), standart saralash - masofa
+    rank = None
+    distances = None
+    if lat is not None:
+        distances = nearby_stores(db, lat, lon, radius_km)
+        if not distances:
+            return [], {}
+        nearby = distance_table(distances)
+        query = query.join(nearby, nearby.c.store_id == SurpriseBag.store_id)
+        if sort in (None, "distance"):
+            sort, rank = "distance", nearby.c.distance
+
+    # Kalit so‘z bo‘yicha qidirish (FTS5 indeksi, prefiks bo‘yicha, mosligi bo‘yicha tartiblangan)
+    matches = search_matches(search) if search else None
+    if matches is not None:
+        query = query.join(matches, matches.c.bag_id == SurpriseBag.id)
+        if sort in (None, "relevance"):
+            sort, rank = "relevance", matches.c.rank
+    if sort in (None, "relevance") and rank is None:
+        sort = "newest"
+
+    # Keyset pagination: keyingi sahifa cursori X-Next-Cursor headerida qaytariladi
+    bags, next_cursor = paginate(query, sort, cursor=cursor, limit=limit, rank=rank)
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    if distances is not None:
+        for bag in bags:
+            bag.distance_km = round(distances[bag.store_id], 3)
+
+    # store_name store join orqali birga yuklanadi
+    return serialize_bags(bags), headers
+
+
+def serialize_bags(bags):
+    return [SurpriseBagResponse.model_validate(bag).model_dump(mode="json") for bag in bags]
+
+# Bag o‘zgarishlari oqimi (SSE): created, updated, quantity_changed, sold_out, deleted
+@app.get("/surprise-bags/stream/")
+async def stream_surprise_bags(
+    request: Request,
+    price_min: Optional[float] = None,
+    price_max: Optional[float] = None,
+    store_name: Optional[str] = None
+):
+    return StreamingResponse(
+        stream_bag_events(request, price_min, price_max, store_name),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 # Buyurtma qo‘shish
 @app.post("/orders/", response_model=OrderResponse)
@@ -302,12 +429,11 @@ def create_order(
     current_user: User = Depends(get_current_customer),
     db: Session = Depends(get_db)
 ):
-    print(f"Received order data: {order}")
     # Quantity ni tekshirish
     if order.quantity <= 0:
         raise HTTPException(status_code=400, detail="Quantity must be positive")
 
-    # SurpriseBag ni topish
+    # SurpriseBag ni topish (tez tekshiruv; haqiqiy band qilish pastda atomik UPDATE bilan)
     db_bag = db.query(SurpriseBag).filter(
         SurpriseBag.id == order.surprise_bag_id,
         SurpriseBag.status == "available",
@@ -338,43 +464,29 @@ def create_order(
             created_at=datetime.utcnow()
         )
         db.add(new_order)
-        db.commit()
-        db.refresh(new_order)
+        db.flush()
         existing_order = new_order
 
-    # SurpriseBag miqdorini kamaytirish
-    db_bag.quantity -= order.quantity
-    # OrderItem yaratish (quantity bilan)
-    new_order_item = OrderItem(
-        order_id=existing_order.id,
-        surprise_bag_id=order.surprise_bag_id,
-        quantity=order.quantity,
-        created_at=datetime.utcnow()
+    # SurpriseBag miqdorini atomik kamaytirish: UPDATE ... WHERE quantity >= :n
+    if not reserve_stock(db, order.surprise_bag_id, order.quantity):
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Surprise Bag sold out or insufficient quantity")
+
+    # "pending" buyurtma zaxira hisoblanadi, muddati har bir qo‘shishda yangilanadi
+    if existing_order.status == "pending":
+        existing_order.expires_at = hold_expiry()
+
+    # OrderItem yaratish: summa va balans faqat shu item narxiga o‘zgaradi
+    item = add_order_item(db, existing_order, db_bag, order.quantity, current_user)
+    db.flush()
+    notify(
+        db, f"order:{existing_order.id}:item:{item.id}:{uuid.uuid4().hex}",
+        f"Order {existing_order.id} updated with Surprise Bag {order.surprise_bag_id}, quantity: {order.quantity}. Customer balance: {current_user.balance}"
     )
-    db.add(new_order_item)
     db.commit()
-    db.refresh(new_order_item)
-    db.refresh(db_bag)
-
-    # Total price ni yangilash (barcha OrderItem lar bo‘yicha)
-    order_items = db.query(OrderItem).filter(OrderItem.order_id == existing_order.id).all()
-    total_price = 0.0
-    for item in order_items:
-        surprise_bag = db.query(SurpriseBag).filter(SurpriseBag.id == item.surprise_bag_id).first()
-        if surprise_bag:
-            total_price += surprise_bag.discount_price * item.quantity
-        item.surprise_bag = surprise_bag
-    existing_order.total_price = total_price
-
-    # Mijozning balansidan pul ayirish
-    current_user.balance -= total_price
-    db.commit()
-    db.refresh(current_user)
-    db.refresh(existing_order)
 
-    existing_order.items = order_items
-    
-    print(f"Notification: Order {existing_order.id} updated with Surprise Bag {order.surprise_bag_id}, quantity: {order.quantity}. Customer balance: {current_user.balance}")
+    existing_order = load_order(db, existing_order.id)
+    publish_bag_event(db_bag)
     
     return existing_order
 
@@ -384,57 +496,35 @@ def get_orders(
     current_user: User = Depends(get_current_customer),
     db: Session = Depends(get_db)
 ):
-    orders = db.query(Order).filter(Order.customer_id == current_user.id).all()
-    for order in orders:
-        order_items = db.query(OrderItem).filter(OrderItem.order_id == order.id).all()
-        for item in order_items:
-            surprise_bag = db.query(SurpriseBag).filter(SurpriseBag.id == item.surprise_bag_id).first()
-            if surprise_bag:
-                # store_name ni qo‘shish
-                surprise_bag.store_name = db.query(User).filter(User.id == surprise_bag.store_id).first().name
-            item.surprise_bag = surprise_bag
-        order.items = order_items
-    return orders
+    # items, surprise_bag va store_name oldindan yuklanadi
+    return db.query(Order).options(*order_options()).filter(Order.customer_id == current_user.id).all()
 @app.get("/store/surprise-bags/", response_model=List[SurpriseBagResponse])
 def get_store_surprise_bags(
+    request: Request,
     search: Optional[str] = None,
     sort: Optional[str] = "newest",
     current_user: User = Depends(get_current_store),
     db: Session = Depends(get_db)
 ):
-    query = db.query(SurpriseBag).filter(SurpriseBag.store_id == current_user.id)
+    def build():
+        query = db.query(SurpriseBag).filter(SurpriseBag.store_id == current_user.id)
 
-    # Search by title
-    if search:
-        query = query.filter(SurpriseBag.title.ilike(f"%{search}%"))
+        # Search by title
+        if search:
+            query = query.filter(SurpriseBag.title.ilike(f"%{search}%"))
 
-    # Sorting
-    if sort == "newest":
-        query = query.order_by(SurpriseBag.created_at.desc())
-    elif sort == "oldest":
-        query = query.order_by(SurpriseBag.created_at.asc())
-    elif sort == "price_low_to_high":
-        query = query.order_by(SurpriseBag.discount_price.asc())
-    elif sort == "price_high_to_low":
-        query = query.order_by(SurpriseBag.discount_price.desc())
+        # Sorting (same options as the public catalog)
+        query = order_by_sort(query, sort)
 
-    bags = query.all()
+        # store_name is resolved from current_user in the identity map, no extra query
+        return serialize_bags(query.all()), {}
 
-    # Add store_name (though not needed for store owner, for consistency)
-    for bag in bags:
-        bag.store_name = current_user.name
+    return cached_json_response(request, db, build, scope=f"store:{current_user.id}")
 
-    return bags
 @app.get("/store/stats/")
 def get_store_stats(current_user: User = Depends(get_current_store), db: Session = Depends(get_db)):
-    total_bags = db.query(SurpriseBag).filter(SurpriseBag.store_id == current_user.id).count()
-    active_bags = db.query(SurpriseBag).filter(SurpriseBag.store_id == current_user.id, SurpriseBag.status == "available").count()
-    total_orders = db.query(Order).join(OrderItem).join(SurpriseBag).filter(SurpriseBag.store_id == current_user.id).count()
-    return {
-        "total_surprise_bags": total_bags,
-        "active_surprise_bags": active_bags,
-        "total_orders": total_orders
-    }
+    # store_stats qatori bag/buyurtma yozuvlari bilan bir tranzaksiyada yangilanadi - bitta PK o‘qish
+    return load_store_stats(db, current_user.id)
 
 # Buyurtmalarni tasdiqlash
 @app.post("/orders/confirm/{order_id}/", response_model=OrderResponse)
@@ -453,16 +543,11 @@ def confirm_order(
         raise HTTPException(status_code=404, detail="Pending order not found or not yours")
     
     order.status = "confirmed"
+    order.expires_at = None
+    notify(db, f"order:{order_id}:confirmed", f"Order {order_id} confirmed for user {current_user.id}")
     db.commit()
-    db.refresh(order)
-    
-    order_items = db.query(OrderItem).filter(OrderItem.order_id == order.id).all()
-    for item in order_items:
-        surprise_bag = db.query(SurpriseBag).filter(SurpriseBag.id == item.surprise_bag_id).first()
-        item.surprise_bag = surprise_bag
-    order.items = order_items
-    
-    print(f"Notification: Order {order_id} confirmed for user {current_user.id}")
+
+    order = load_order(db, order_id)
     
     return order
 
@@ -473,7 +558,7 @@ def cancel_order(
     current_user: User = Depends(get_current_customer),
     db: Session = Depends(get_db)
 ):
-    order = db.query(Order).filter(
+    order = db.query(Order).options(*order_options()).filter(
         Order.id == order_id,
         Order.customer_id == current_user.id
     ).first()
@@ -481,46 +566,25 @@ def cancel_order(
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
-    if order.status == "completed":
-        order_items = db.query(OrderItem).filter(OrderItem.order_id == order.id).all()
-        if not order_items:
-            raise HTTPException(status_code=400, detail="Order has no items")
-
-        first_item = order_items[0]
-        surprise_bag = db.query(SurpriseBag).filter(SurpriseBag.id == first_item.surprise_bag_id).first()
-        if not surprise_bag:
-            raise HTTPException(status_code=404, detail="Surprise Bag not found")
-
-        shop_owner = db.query(User).filter(User.id == surprise_bag.store_id).first()
-        if not shop_owner:
-            raise HTTPException(status_code=404, detail="Shop owner not found")
-
-        shop_owner.balance -= order.total_price
-        db.commit()
-        db.refresh(shop_owner)
-    
+    # Bajarilgan buyurtma bu yerda bekor qilinmaydi: sotuv qaytarilishi faqat refund orqali
     if order.status not in ["pending", "confirmed"]:
         raise HTTPException(status_code=400, detail="Order can only be cancelled in pending or confirmed status")
     
-    order_items = db.query(OrderItem).filter(OrderItem.order_id == order.id).all()
-    for item in order_items:
-        db_bag = db.query(SurpriseBag).filter(SurpriseBag.id == item.surprise_bag_id).first()
-        if db_bag:
-            db_bag.quantity += item.quantity
-            db.commit()
-            db.refresh(db_bag)
+    release_items(db, order.items)
     
     order.status = "cancelled"
-    current_user.balance += order.total_price
+    order.expires_at = None
+    post_entry(db, current_user.id, order.total_price, "order_cancel", order.id)
+    db.flush()
+    notify(
+        db, f"order:{order_id}:cancelled",
+        f"Order {order_id} was cancelled by user {current_user.id}. Customer balance: {current_user.balance}"
+    )
     db.commit()
-    db.refresh(order)
-    db.refresh(current_user)
-    
-    for item in order_items:
-        item.surprise_bag = db.query(SurpriseBag).filter(SurpriseBag.id == item.surprise_bag_id).first()
-    order.items = order_items
-    
-    print(f"Notification: Order {order_id} was cancelled by user {current_user.id}. Customer balance: {current_user.balance}")
+
+    order = load_order(db, order_id)
+    for bag in {item.surprise_bag_id: item.surprise_bag for item in order.items}.values():
+        publish_bag_event(bag)
     
     return order
 
@@ -531,7 +595,7 @@ def complete_order(
     current_user: User = Depends(get_current_customer),
     db: Session = Depends(get_db)
 ):
-    order = db.query(Order).filter(
+    order = db.query(Order).options(*order_options()).filter(
         Order.id == order_id,
         Order.customer_id == current_user.id,
         Order.status == "confirmed"
@@ -540,30 +604,27 @@ def complete_order(
     if not order:
         raise HTTPException(status_code=404, detail="Order not found or not in confirmed status")
     
-    order_items = db.query(OrderItem).filter(OrderItem.order_id == order.id).all()
-    if not order_items:
+    if not order.items:
         raise HTTPException(status_code=400, detail="Order has no items")
 
-    first_item = order_items[0]
-    surprise_bag = db.query(SurpriseBag).filter(SurpriseBag.id == first_item.surprise_bag_id).first()
+    surprise_bag = order.items[0].surprise_bag
     if not surprise_bag:
         raise HTTPException(status_code=404, detail="Surprise Bag not found")
 
-    shop_owner = db.query(User).filter(User.id == surprise_bag.store_id).first()
+    shop_owner = surprise_bag.store
     if not shop_owner:
         raise HTTPException(status_code=404, detail="Shop owner not found")
 
     order.status = "completed"
-    shop_owner.balance += order.total_price
+    post_entry(db, shop_owner.id, order.total_price, "sale", order.id)
+    db.flush()
+    notify(
+        db, f"order:{order_id}:completed",
+        f"Order {order_id} was completed by user {current_user.id}. Shop owner balance: {shop_owner.balance}"
+    )
     db.commit()
-    db.refresh(order)
-    db.refresh(shop_owner)
 
-    for item in order_items:
-        item.surprise_bag = db.query(SurpriseBag).filter(SurpriseBag.id == item.surprise_bag_id).first()
-    order.items = order_items
-    
-    print(f"Notification: Order {order_id} was completed by user {current_user.id}. Shop owner balance: {shop_owner.balance}")
+    order = load_order(db, order_id)
     
     return order
 
@@ -574,7 +635,7 @@ def refund_order(
     current_user: User = Depends(get_current_customer),
     db: Session = Depends(get_db)
 ):
-    order = db.query(Order).filter(
+    order = db.query(Order).options(*order_options()).filter(
         Order.id == order_id,
         Order.customer_id == current_user.id,
         Order.status == "completed"
@@ -583,40 +644,33 @@ def refund_order(
     if not order:
         raise HTTPException(status_code=404, detail="Completed order not found or not yours")
     
-    order_items = db.query(OrderItem).filter(OrderItem.order_id == order.id).all()
-    if not order_items:
+    if not order.items:
         raise HTTPException(status_code=400, detail="Order has no items")
 
-    first_item = order_items[0]
-    surprise_bag = db.query(SurpriseBag).filter(SurpriseBag.id == first_item.surprise_bag_id).first()
+    surprise_bag = order.items[0].surprise_bag
     if not surprise_bag:
         raise HTTPException(status_code=404, detail="Surprise Bag not found")
 
-    shop_owner = db.query(User).filter(User.id == surprise_bag.store_id).first()
+    shop_owner = surprise_bag.store
     if not shop_owner:
         raise HTTPException(status_code=404, detail="Shop owner not found")
 
-    shop_owner.balance -= order.total_price
-    current_user.balance += order.total_price
+    post_entry(db, shop_owner.id, -order.total_price, "sale_reversal", order.id)
+    post_entry(db, current_user.id, order.total_price, "refund", order.id)
     order.status = "cancelled"
     
-    for item in order_items:
-        db_bag = db.query(SurpriseBag).filter(SurpriseBag.id == item.surprise_bag_id).first()
-        if db_bag:
-            db_bag.quantity += item.quantity
-            db.commit()
-            db.refresh(db_bag)
+    release_items(db, order.items)
 
+    db.flush()
+    notify(
+        db, f"order:{order_id}:refunded",
+        f"Order {order_id} was refunded for user {current_user.id}. Customer balance: {current_user.balance}, Shop owner balance: {shop_owner.balance}"
+    )
     db.commit()
-    db.refresh(order)
-    db.refresh(shop_owner)
-    db.refresh(current_user)
 
-    for item in order_items:
-        item.surprise_bag = db.query(SurpriseBag).filter(SurpriseBag.id == item.surprise_bag_id).first()
-    order.items = order_items
-    
-    print(f"Notification: Order {order_id} was refunded for user {current_user.id}. Customer balance: {current_user.balance}, Shop owner balance: {shop_owner.balance}")
+    order = load_order(db, order_id)
+    for bag in {item.surprise_bag_id: item.surprise_bag for item in order.items}.values():
+        publish_bag_event(bag)
     
     return order
 
@@ -626,26 +680,8 @@ def get_store_orders(
     current_user: User = Depends(get_current_store),
     db: Session = Depends(get_db)
 ):
-    store_bags = db.query(SurpriseBag).filter(SurpriseBag.store_id == current_user.id).all()
-    if not store_bags:
-        return []
-
-    bag_ids = [bag.id for bag in store_bags]
-    order_items = db.query(OrderItem).filter(OrderItem.surprise_bag_id.in_(bag_ids)).all()
-    if not order_items:
-        return []
-
-    order_ids = list(set(item.order_id for item in order_items))
-    orders = db.query(Order).filter(Order.id.in_(order_ids)).all()
-
-    for order in orders:
-        order.items = [
-            item for item in order_items if item.order_id == order.id
-        ]
-        for item in order.items:
-            item.surprise_bag = db.query(SurpriseBag).filter(SurpriseBag.id == item.surprise_bag_id).first()
-
-    return orders
+    # Faqat shu do‘konning itemlari bilan, bitta join so‘rovda
+    return load_store_orders(db, current_user.id)
 
 # Foydalanuvchi balansini ko‘rish
 @app.get("/user/balance/")
@@ -665,13 +701,13 @@ def deposit_balance(
     if amount <= 0:
         raise HTTPException(status_code=400, detail="Deposit amount must be positive")
     
-    current_user.balance += amount
+    entry = post_entry(db, current_user.id, amount, "deposit")
+    db.flush()
+    new_balance = current_user.balance
+    notify(db, f"deposit:{entry.id}", f"User {current_user.id} deposited {amount}. New balance: {new_balance}")
     db.commit()
-    db.refresh(current_user)
     
-    print(f"Notification: User {current_user.id} deposited {amount}. New balance: {current_user.balance}")
-    
-    return {"message": "Balance deposited successfully", "new_balance": current_user.balance}
+    return {"message": "Balance deposited successfully", "new_balance": new_balance}
 
 # Foydalanuvchi profilini yangilash
 @app.put("/user/update/", response_model=UserResponse)
@@ -680,8 +716,10 @@ def update_user(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    if not any([user_update.name, user_update.email, user_update.phone, user_update.password]):
+    if not any([user_update.name, user_update.email, user_update.phone, user_update.password,
+                user_update.latitude is not None, user_update.longitude is not None]):
         raise HTTPException(status_code=400, detail="At least one field must be provided to update")
+    validate_coordinates(user_update.latitude, user_update.longitude)
 
     if user_update.email and user_update.email != current_user.email:
         existing_email = db.query(User).filter(User.email == user_update.email).first()
@@ -700,11 +738,14 @@ def update_user(
         current_user.phone = user_update.phone
     if user_update.password:
         current_user.hashed_password = pwd_context.hash(user_update.password)
+    if user_update.latitude is not None:
+        current_user.latitude = user_update.latitude
+        current_user.longitude = user_update.longitude
+        current_user.geo_cell = grid_cell(user_update.latitude, user_update.longitude)
 
+    notify(db, f"user:{current_user.id}:profile:{uuid.uuid4().hex}", f"User {current_user.id} updated their profile.")
     db.commit()
     db.refresh(current_user)
-
-    print(f"Notification: User {current_user.id} updated their profile.")
     
     return current_user
 
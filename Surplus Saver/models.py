@@ -1,12 +1,17 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey, DateTime
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey, DateTime, Index, text
+from sqlalchemy.orm import relationship, object_session
 from database import Base
 from pydantic import BaseModel, validator
-from typing import Optional, List
+from typing import Optional, List, Dict
 from datetime import datetime
 
 
 # SQLAlchemy modellar
+
+# Katalogdagi "tirik" baglar sharti: partial indekslar va katalog so‘rovi aynan shu matndan
+# foydalanadi (SQLite partial indeksni faqat shart so‘rovda literal holda bo‘lsa ishlatadi)
+LIVE_BAG_CONDITION = "surprise_bags.status = 'available' AND surprise_bags.is_active = 1"
+
 class User(Base):
     __tablename__ = "users"
 
@@ -16,12 +21,23 @@ class User(Base):
     phone = Column(String, unique=True, nullable=False)
     hashed_password = Column(String, nullable=False)
     role = Column(String, nullable=False)
-    balance = Column(Float, default=0.0)
+    # Boshlang‘ich balans; keyingi barcha o‘zgarishlar balance_entries jadvalida
+    opening_balance = Column("balance", Float, default=0.0)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Do‘kon joylashuvi; geo_cell - panjara katakchasi (geo.grid_cell), yaqin atrofni qidirish indeksi
+    latitude = Column(Float, nullable=True)
+    longitude = Column(Float, nullable=True)
+    geo_cell = Column(Integer, nullable=True, index=True)
 
     surprise_bags = relationship("SurpriseBag", back_populates="store")
     orders = relationship("Order", back_populates="customer")
 
+    # Joriy balans: oxirgi snapshot + undan keyingi yozuvlar (ledger.get_balance)
+    @property
+    def balance(self):
+        from ledger import get_balance
+        return get_balance(object_session(self), self)
+
 class SurpriseBag(Base):
     __tablename__ = "surprise_bags"
 
@@ -37,10 +53,37 @@ class SurpriseBag(Base):
     status = Column(String, default="available")
     created_at = Column(DateTime, default=datetime.utcnow)
     image_url = Column(String, nullable=True)
+    # Tayyor bo‘lgan thumbnail kengliklari, masalan "160,320,640" (fon vazifasi yozadi)
+    thumbnail_widths = Column(String, nullable=True)
+    # Olib ketish oynasi va yaroqlilik muddati; expires_at o‘tgach sweeper bagni "expired" qiladi
+    pickup_start = Column(DateTime, nullable=True)
+    pickup_end = Column(DateTime, nullable=True)
+    expires_at = Column(DateTime, nullable=True)
 
     store = relationship("User", back_populates="surprise_bags")
     order_items = relationship("OrderItem", back_populates="surprise_bag")
 
+    # Katalog faqat tirik baglarni sana yoki narx bo‘yicha saralaydi: partial indekslarda
+    # sotilgan/muddati o‘tgan baglar yo‘q. SQLite indeksida rowid (id) ham bor, shuning uchun
+    # keyset (kalit, id) to‘liq indeksdan o‘qiladi. Sweeper esa expires_at indeksidan foydalanadi.
+    __table_args__ = (
+        Index("ix_surprise_bags_live_created", "created_at", sqlite_where=text(LIVE_BAG_CONDITION)),
+        Index("ix_surprise_bags_live_price", "discount_price", sqlite_where=text(LIVE_BAG_CONDITION)),
+        Index("ix_surprise_bags_live_expires", "expires_at", sqlite_where=text("surprise_bags.is_active = 1 AND surprise_bags.expires_at IS NOT NULL")),
+    )
+
+    # SurpriseBagResponse.store_name uchun; store eager yuklangan bo‘lsa qo‘shimcha so‘rov yo‘q
+    @property
+    def store_name(self):
+        return self.store.name if self.store else None
+
+    @property
+    def thumbnail_urls(self):
+        if not self.image_url or not self.thumbnail_widths:
+            return None
+        from uploads import thumbnail_url
+        return {int(width): thumbnail_url(self.image_url, int(width)) for width in self.thumbnail_widths.split(",")}
+
 class Order(Base):
     __tablename__ = "orders"
 
@@ -49,6 +92,8 @@ class Order(Base):
     status = Column(String, default="pending")
     total_price = Column(Float, default=0.0)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # "pending" buyurtma zaxirasi shu vaqtgacha tasdiqlanmasa, mahsulot omborga qaytariladi
+    expires_at = Column(DateTime, nullable=True, index=True)
 
     customer = relationship("User", back_populates="orders")
     items = relationship("OrderItem", back_populates="order")
@@ -60,11 +105,88 @@ class OrderItem(Base):
     order_id = Column(Integer, ForeignKey("orders.id"), nullable=False)
     surprise_bag_id = Column(Integer, ForeignKey("surprise_bags.id"), nullable=False)
     quantity = Column(Integer, nullable=False)
+    # Sotib olingan paytdagi narx (discount_price keyin o‘zgarsa ham summa o‘zgarmaydi)
+    unit_price = Column(Float, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
     order = relationship("Order", back_populates="items")
     surprise_bag = relationship("SurpriseBag", back_populates="order_items")
 
+# Content-addressed rasm: hash bo‘yicha bitta fayl, ref_count - unga ishora qiluvchi baglar soni
+class StoredImage(Base):
+    __tablename__ = "stored_images"
+
+    hash = Column(String, primary_key=True)
+    url = Column(String, unique=True, nullable=False)
+    size = Column(Integer, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0)
+    thumbnail_widths = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+# Balans o‘zgarishlari faqat qo‘shiladi (insert-only), hech qachon yangilanmaydi
+class BalanceEntry(Base):
+    __tablename__ = "balance_entries"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    amount = Column(Float, nullable=False)
+    reason = Column(String, nullable=False)
+    order_id = Column(Integer, ForeignKey("orders.id"), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_balance_entries_user_entry", "user_id", "id"),
+    )
+
+# Compaction yozadigan snapshot: last_entry_id gacha bo‘lgan yozuvlar yig‘indisi
+class BalanceSnapshot(Base):
+    __tablename__ = "balance_snapshots"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    balance = Column(Float, nullable=False)
+    last_entry_id = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_balance_snapshots_user_entry", "user_id", "last_entry_id"),
+    )
+
+# Do‘kon statistikasi: stats.py dagi triggerlar bag va buyurtma yozuvlari bilan birga yangilaydi
+class StoreStats(Base):
+    __tablename__ = "store_stats"
+
+    store_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    total_bags = Column(Integer, nullable=False, server_default=text("0"))
+    active_bags = Column(Integer, nullable=False, server_default=text("0"))
+    total_orders = Column(Integer, nullable=False, server_default=text("0"))
+    items_sold = Column(Integer, nullable=False, server_default=text("0"))
+    revenue = Column(Float, nullable=False, server_default=text("0"))
+    discount_pct_sum = Column(Float, nullable=False, server_default=text("0"))
+
+# Katalog versiyasi (bitta qator): catalog_cache.py dagi triggerlar har bir bag/buyurtma yozuvida oshiradi
+class CatalogVersion(Base):
+    __tablename__ = "catalog_version"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, server_default=text("0"))
+
+# Bildirishnomalar outbox i: biznes o‘zgarishi bilan bitta tranzaksiyada yoziladi, outbox.py yetkazadi
+class NotificationOutbox(Base):
+    __tablename__ = "notification_outbox"
+
+    id = Column(Integer, primary_key=True, index=True)
+    dedup_key = Column(String, unique=True, nullable=False)
+    message = Column(String, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    enqueued_at = Column(DateTime, nullable=True)
+    delivered_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_notification_outbox_pending", "delivered_at", "id"),
+    )
+
 # Pydantic modellar
 class UserCreate(BaseModel):
     name: str
@@ -73,6 +195,8 @@ class UserCreate(BaseModel):
     password: str
     role: str
     balance: float = 0.0
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
 
 class UserResponse(BaseModel):
     id: int
@@ -82,6 +206,8 @@ class UserResponse(BaseModel):
     role: str
     balance: float
     created_at: datetime
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
 
     class Config:
         from_attributes = True
@@ -91,6 +217,8 @@ class UserUpdate(BaseModel):
     email: Optional[str] = None
     phone: Optional[str] = None
     password: Optional[str] = None
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
 
 class SurpriseBagCreate(BaseModel):
     title: str
@@ -100,6 +228,9 @@ class SurpriseBagCreate(BaseModel):
     discount_price: float
     quantity: int
     is_active: bool = True
+    pickup_start: Optional[datetime] = None
+    pickup_end: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
 
 class SurpriseBagUpdate(BaseModel):
     title: Optional[str] = None
@@ -109,6 +240,9 @@ class SurpriseBagUpdate(BaseModel):
     discount_price: Optional[float] = None
     quantity: Optional[int] = None
     is_active: Optional[bool] = None
+    pickup_start: Optional[datetime] = None
+    pickup_end: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
 
 class SurpriseBagResponse(BaseModel):
     id: int
@@ -124,6 +258,12 @@ class SurpriseBagResponse(BaseModel):
     status: str
     created_at: datetime
     image_url: Optional[str] = None
+    thumbnail_urls: Optional[Dict[int, str]] = None
+    pickup_start: Optional[datetime] = None
+    pickup_end: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
+    # Faqat yaqin atrofni qidirishda (lat/lon berilganda) to‘ldiriladi
+    distance_km: Optional[float] = None
 
     class Config:
         from_attributes = True
@@ -133,6 +273,7 @@ class OrderItemResponse(BaseModel):
     order_id: int
     surprise_bag_id: int
     quantity: int
+    unit_price: Optional[float] = None
     surprise_bag: Optional[SurpriseBagResponse] = None
     created_at: datetime
 
@@ -145,6 +286,7 @@ class OrderResponse(BaseModel):
     status: str
     total_price: float
     created_at: datetime
+    expires_at: Optional[datetime] = None
     items: List[OrderItemResponse]
 
     class Config:
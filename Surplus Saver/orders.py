@@ -0,0 +1,38 @@
+from datetime import datetime
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from models import User, SurpriseBag, Order, OrderItem
+from ledger import post_entry
+
+# Buyurtma summasini inkremental yuritish.
+# Har bir OrderItem sotib olingan paytdagi narxni (unit_price) saqlaydi, shuning uchun
+# do‘kon keyinroq discount_price ni o‘zgartirsa ham buyurtma summasi o‘zgarmaydi.
+
+
+def add_order_item(db: Session, order: Order, bag: SurpriseBag, quantity: int, customer: User) -> OrderItem:
+    """
+    Buyurtmaga item qo‘shadi: summa faqat shu item narxiga o‘zgaradi (SQL da
+    `total_price + :line_total`), mijoz balansidan esa ledger yozuvi bilan ayiriladi.
+    """
+    line_total = bag.discount_price * quantity
+    item = OrderItem(
+        order_id=order.id,
+        surprise_bag_id=bag.id,
+        quantity=quantity,
+        unit_price=bag.discount_price,
+        created_at=datetime.utcnow()
+    )
+    db.add(item)
+    order.total_price = Order.total_price + line_total
+    post_entry(db, customer.id, -line_total, "order", order.id)
+    return item
+
+
+def backfill_unit_prices(engine):
+    """unit_price ustuni qo‘shilishidan oldingi itemlar uchun joriy narxni yozib qo‘yadi."""
+    with engine.begin() as conn:
+        conn.execute(text(
+            "UPDATE order_items SET unit_price = ("
+            "SELECT discount_price FROM surprise_bags WHERE surprise_bags.id = order_items.surprise_bag_id"
+            ") WHERE unit_price IS NULL"
+        ))
@@ -0,0 +1,97 @@
+from datetime import datetime, timedelta
+from sqlalchemy import update, or_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from models import NotificationOutbox
+
+# Bildirishnomalar outbox i.
+# Endpoint bildirishnomani notify() bilan biznes o‘zgarishi bilan bitta tranzaksiyada yozadi:
+# commit bo‘lmasa bildirishnoma ham yo‘q, commit bo‘lsa - yo‘qolmaydi (jarayon qulasa ham).
+# dispatch_pending (Celery beat) qatorlarni partiyalab send_notification ga navbatga qo‘yadi.
+# Yetkazish kamida bir marta (at-least-once): navbatga qo‘yilgan, lekin REDELIVER_AFTER ichida
+# yetkazilmagan qator qayta yuboriladi; takrorlarni send_notification dedup_key bo‘yicha tashlaydi.
+# dedup_key har bir hodisa uchun yagona bo‘lishi kerak: SQLite o‘chirilgan eng katta id ni qayta beradi
+# (surprise_bags, order_items da AUTOINCREMENT yo‘q), shuning uchun faqat id ga tayangan kalitga uuid qo‘shiladi.
+
+DISPATCH_BATCH_SIZE = 100
+REDELIVER_AFTER = timedelta(minutes=5)
+# Yetkazilgan qatorlar dedup uchun shuncha vaqt saqlanadi
+DELIVERED_RETENTION = timedelta(days=7)
+
+
+def notify(db: Session, dedup_key: str, message: str):
+    """Bildirishnomani outbox ga qo‘shadi (commit chaqiruvchida). Shu kalit bor bo‘lsa - e’tiborsiz."""
+    db.execute(
+        sqlite_insert(NotificationOutbox)
+        .values(dedup_key=dedup_key, message=message, attempts=0, created_at=datetime.utcnow())
+        .on_conflict_do_nothing(index_elements=[NotificationOutbox.dedup_key])
+    )
+
+
+def claim_batch(db: Session, now: datetime = None, batch_size: int = DISPATCH_BATCH_SIZE) -> list:
+    """
+    Yetkazilmagan va hozir navbatda turmagan qatorlarni bitta shartli UPDATE bilan egallaydi
+    (parallel dispatcherlar bir qatorni bir vaqtda olmaydi). [(id, dedup_key, message)] qaytaradi.
+    """
+    now = now or datetime.utcnow()
+    pending = (
+        db.query(NotificationOutbox.id)
+        .filter(
+            NotificationOutbox.delivered_at == None,
+            or_(NotificationOutbox.enqueued_at == None, NotificationOutbox.enqueued_at < now - REDELIVER_AFTER)
+        )
+        .order_by(NotificationOutbox.id)
+        .limit(batch_size)
+        .scalar_subquery()
+    )
+    rows = db.execute(
+        update(NotificationOutbox)
+        .where(
+            NotificationOutbox.id.in_(pending),
+            NotificationOutbox.delivered_at == None,
+            or_(NotificationOutbox.enqueued_at == None, NotificationOutbox.enqueued_at < now - REDELIVER_AFTER)
+        )
+        .values(enqueued_at=now, attempts=NotificationOutbox.attempts + 1)
+        .returning(NotificationOutbox.id, NotificationOutbox.dedup_key, NotificationOutbox.message)
+        .execution_options(synchronize_session=False)
+    ).all()
+    db.commit()
+    return sorted(rows)
+
+
+def dispatch_pending(db: Session, send, batch_size: int = DISPATCH_BATCH_SIZE) -> int:
+    """Outbox ni partiyalab bo‘shatadi: har bir qator uchun send(dedup_key, message). Yuborilganlar soni."""
+    dispatched = 0
+    while True:
+        batch = claim_batch(db, batch_size=batch_size)
+        for _, dedup_key, message in batch:
+            send(dedup_key, message)
+        dispatched += len(batch)
+        if len(batch) < batch_size:
+            return dispatched
+
+
+def begin_delivery(db: Session, dedup_key: str) -> bool:
+    """Shu kalit allaqachon yetkazilgan bo‘lsa False (takroriy yuborish)."""
+    delivered = db.query(NotificationOutbox.delivered_at).filter(NotificationOutbox.dedup_key == dedup_key).scalar()
+    return delivered is None
+
+
+def mark_delivered(db: Session, dedup_key: str):
+    db.execute(
+        update(NotificationOutbox)
+        .where(NotificationOutbox.dedup_key == dedup_key, NotificationOutbox.delivered_at == None)
+        .values(delivered_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+
+def prune_delivered(db: Session, now: datetime = None) -> int:
+    now = now or datetime.utcnow()
+    deleted = db.query(NotificationOutbox).filter(
+        NotificationOutbox.delivered_at != None,
+        NotificationOutbox.delivered_at < now - DELIVERED_RETENTION
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
@@ -0,0 +1,94 @@
+import base64
+import json
+from datetime import datetime
+from fastapi import HTTPException
+from sqlalchemy import tuple_, literal
+from typing import Optional
+from models import SurpriseBag
+
+# Katalog uchun keyset (cursor) pagination.
+# Har bir saralash (sort) uchun: kalit ustun va yo‘nalish; id - teng qiymatlarni ajratuvchi.
+SORT_OPTIONS = {
+    "newest": (SurpriseBag.created_at, "desc"),
+    "oldest": (SurpriseBag.created_at, "asc"),
+    "price_low_to_high": (SurpriseBag.discount_price, "asc"),
+    "price_high_to_low": (SurpriseBag.discount_price, "desc"),
+}
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+
+
+def _to_json(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _from_json(value, key):
+    if key is SurpriseBag.created_at:
+        return datetime.fromisoformat(value)
+    return float(value)
+
+
+def encode_cursor(sort: str, key_value, bag_id: int) -> str:
+    payload = json.dumps({"s": sort, "k": _to_json(key_value), "id": bag_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str, key):
+    """Cursor dan (kalit qiymati, id) ni qaytaradi; noto‘g‘ri yoki boshqa sort uchun bo‘lsa 400."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if payload["s"] != sort:
+            raise ValueError("sort mismatch")
+        return _from_json(payload["k"], key), int(payload["id"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def order_by_sort(query, sort: str):
+    """Saralashni qo‘llash (sahifalashsiz), noma’lum sort e’tiborsiz qoldiriladi."""
+    if sort not in SORT_OPTIONS:
+        return query
+    key, direction = SORT_OPTIONS[sort]
+    if direction == "desc":
+        return query.order_by(key.desc(), SurpriseBag.id.desc())
+    return query.order_by(key.asc(), SurpriseBag.id.asc())
+
+
+def paginate(query, sort: str, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE, rank=None):
+    """
+    Keyset pagination: (kalit, id) bo‘yicha cursor dan keyingi `limit` ta bag.
+    rank berilsa (FTS qidiruv), natijalar moslik bo‘yicha saralanadi.
+    (bags, next_cursor) qaytaradi; oxirgi sahifada next_cursor None.
+    """
+    if rank is not None:
+        key, direction = rank, "asc"
+        query = query.add_columns(rank)
+    else:
+        key, direction = SORT_OPTIONS[sort]
+
+    if cursor:
+        key_value, last_id = decode_cursor(cursor, sort, key)
+        position = tuple_(key, SurpriseBag.id)
+        after = tuple_(literal(key_value, key.type), literal(last_id))
+        query = query.filter(position < after if direction == "desc" else position > after)
+
+    if direction == "desc":
+        query = query.order_by(key.desc(), SurpriseBag.id.desc())
+    else:
+        query = query.order_by(key.asc(), SurpriseBag.id.asc())
+
+    rows = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    if rank is not None:
+        bags = [bag for bag, _ in rows]
+        last_key = rows[-1][1] if rows else None
+    else:
+        bags = rows
+        last_key = getattr(bags[-1], key.key) if bags else None
+
+    next_cursor = encode_cursor(sort, last_key, bags[-1].id) if has_more else None
+    return bags, next_cursor
@@ -0,0 +1,126 @@
+from datetime import datetime, timedelta
+from sqlalchemy import update, case, or_
+from sqlalchemy.orm import Session, selectinload
+from models import SurpriseBag, Order
+from ledger import post_entry
+
+# Zaxira (reservation) mexanizmi.
+# Miqdor Python da tekshirilib keyin kamaytirilmaydi: bitta shartli UPDATE
+# (quantity >= :n) ham tekshiradi, ham kamaytiradi, shuning uchun bir vaqtdagi
+# buyurtmalar ortiqcha sotishga olib kelmaydi va writer lock juda qisqa ushlanadi.
+# "pending" buyurtma - bu zaxira; HOLD_TTL ichida tasdiqlanmasa omborga qaytariladi.
+
+HOLD_TTL = timedelta(minutes=15)
+RELEASE_BATCH_SIZE = 100
+
+
+def reserve_stock(db: Session, bag_id: int, quantity: int) -> bool:
+    """Bag dan `quantity` ta band qiladi. Yetarli bo‘lmasa yoki bag faol bo‘lmasa False."""
+    result = db.execute(
+        update(SurpriseBag)
+        .where(
+            SurpriseBag.id == bag_id,
+            SurpriseBag.status == "available",
+            SurpriseBag.is_active == True,
+            SurpriseBag.quantity >= quantity,
+            # Sweeper hali ishlamagan bo‘lsa ham muddati o‘tgan bag band qilinmaydi
+            or_(SurpriseBag.expires_at == None, SurpriseBag.expires_at > datetime.utcnow())
+        )
+        .values(
+            quantity=SurpriseBag.quantity - quantity,
+            status=case((SurpriseBag.quantity - quantity > 0, "available"), else_="sold")
+        )
+        .execution_options(synchronize_session="fetch")
+    )
+    return result.rowcount == 1
+
+
+def release_items(db: Session, items):
+    """
+    Band qilingan miqdorni omborga qaytaradi (bekor qilish, refund, muddati o‘tgan zaxira).
+    Item soni qancha bo‘lmasin bitta UPDATE: bir bagdagi itemlar jamlanadi.
+    """
+    quantities = {}
+    for item in items:
+        quantities[item.surprise_bag_id] = quantities.get(item.surprise_bag_id, 0) + item.quantity
+    if not quantities:
+        return
+    amount = case(quantities, value=SurpriseBag.id)
+    db.execute(
+        update(SurpriseBag)
+        .where(SurpriseBag.id.in_(quantities))
+        .values(
+            quantity=SurpriseBag.quantity + amount,
+            status=case(
+                (SurpriseBag.is_active == True, "available"),
+                (SurpriseBag.status == "expired", "expired"),
+                else_="sold"
+            )
+        )
+        .execution_options(synchronize_session="fetch")
+    )
+
+
+def hold_expiry(now: datetime = None) -> datetime:
+    return (now or datetime.utcnow()) + HOLD_TTL
+
+
+def release_expired_holds(db: Session, now: datetime = None, batch_size: int = RELEASE_BATCH_SIZE) -> int:
+    """
+    Muddati o‘tgan "pending" buyurtmalarni bekor qiladi: mahsulot omborga,
+    pul mijoz balansiga qaytadi. Bekor qilingan buyurtmalar sonini qaytaradi.
+    """
+    now = now or datetime.utcnow()
+    expired_ids = [
+        order_id for (order_id,) in db.query(Order.id).filter(
+            Order.status == "pending",
+            Order.expires_at != None,
+            Order.expires_at < now
+        ).limit(batch_size)
+    ]
+    released = sum(1 for order_id in expired_ids if cancel_hold(db, order_id, "hold_expired", Order.expires_at < now))
+    db.commit()
+    return released
+
+
+def cancel_hold(db: Session, order_id: int, reason: str, *conditions) -> bool:
+    """
+    "pending" buyurtmani bekor qiladi: mahsulot omborga, pul mijozga (ledger `reason` bilan).
+    Buyurtma shartli "egallanadi": shu orada tasdiqlangan bo‘lsa, False. Commit chaqiruvchida.
+    """
+    claimed = db.execute(
+        update(Order)
+        .where(Order.id == order_id, Order.status == "pending", *conditions)
+        .values(status="cancelled", expires_at=None)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not claimed:
+        return False
+
+    order = db.query(Order).options(selectinload(Order.items)).filter(Order.id == order_id).one()
+    release_items(db, order.items)
+    post_entry(db, order.customer_id, order.total_price, reason, order.id)
+    return True
+
+
+def release_order_lines(db: Session, order: Order, items, reason: str) -> bool:
+    """
+    "pending" buyurtmadan faqat berilgan itemlarni chiqaradi: ular omborga, ularning summasi mijozga
+    (ledger `reason` bilan) qaytadi va buyurtma summasi shunga kamayadi; qolgan itemlar zaxirada qoladi.
+    Buyurtma shu orada tasdiqlangan bo‘lsa, False. Commit chaqiruvchida.
+    """
+    refund = sum(item.unit_price * item.quantity for item in items)
+    claimed = db.execute(
+        update(Order)
+        .where(Order.id == order.id, Order.status == "pending")
+        .values(total_price=Order.total_price - refund)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not claimed:
+        return False
+
+    release_items(db, items)
+    for item in items:
+        db.delete(item)
+    post_entry(db, order.customer_id, refund, reason, order.id)
+    return True
@@ -0,0 +1,91 @@
+import re
+from sqlalchemy import text, column, Integer, Float
+
+# SurpriseBag katalogi uchun FTS5 indeksi.
+# surprise_bags_fts "external content" jadval: matnning o'zi surprise_bags da
+# saqlanadi, indeks esa triggerlar orqali sinxron yangilanadi (create, update, delete).
+FTS_TABLE = "surprise_bags_fts"
+
+# bm25 og'irliklari: title > description > contents
+RANK_WEIGHTS = (10.0, 4.0, 1.0)
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+_SCHEMA = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        title, description, contents,
+        content='surprise_bags', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS surprise_bags_fts_ai AFTER INSERT ON surprise_bags BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, description, contents)
+        VALUES (new.id, new.title, new.description, new.contents);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS surprise_bags_fts_ad AFTER DELETE ON surprise_bags BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, description, contents)
+        VALUES ('delete', old.id, old.title, old.description, old.contents);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS surprise_bags_fts_au
+    AFTER UPDATE OF title, description, contents ON surprise_bags BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, description, contents)
+        VALUES ('delete', old.id, old.title, old.description, old.contents);
+        INSERT INTO {FTS_TABLE}(rowid, title, description, contents)
+        VALUES (new.id, new.title, new.description, new.contents);
+    END
+    """,
+]
+
+
+def init_search_index(engine):
+    """FTS5 jadvali va triggerlarni yaratadi, yangi indeksni mavjud qatorlar bilan to'ldiradi."""
+    with engine.begin() as conn:
+        exists = conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {"name": FTS_TABLE}
+        ).first()
+        for statement in _SCHEMA:
+            conn.exec_driver_sql(statement)
+        if not exists:
+            conn.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def rebuild_search_index(engine):
+    """Indeksni surprise_bags jadvalidan qaytadan quradi."""
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def build_match_query(search: str):
+    """Foydalanuvchi matnini xavfsiz FTS5 so'roviga aylantiradi: har bir so'z prefiks sifatida, AND bilan."""
+    tokens = _TOKEN_RE.findall(search or "")
+    if not tokens:
+        return None
+    return " ".join(f'"{token}"*' for token in tokens)
+
+
+def search_matches(search: str):
+    """
+    MATCH natijalarini (bag_id, rank) subquery sifatida qaytaradi.
+    rank - bm25 qiymati, qanchalik kichik bo'lsa shunchalik mos.
+    """
+    match_query = build_match_query(search)
+    if match_query is None:
+        return None
+    weights = ", ".join(str(weight) for weight in RANK_WEIGHTS)
+    return (
+        text(
+            f"SELECT rowid AS bag_id, bm25({FTS_TABLE}, {weights}) AS rank "
+            f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match_query"
+        )
+        .bindparams(match_query=match_query)
+        .columns(column("bag_id", Integer), column("rank", Float))
+        .subquery("search_matches")
+    )
@@ -0,0 +1,198 @@
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from models import StoreStats
+
+# Do‘kon statistikasi (store_stats) - materializatsiya qilingan jadval.
+# SQLite triggerlari uni bag va buyurtma yozuvlari bilan bitta tranzaksiyada yangilaydi,
+# shuning uchun /store/stats/ har safar COUNT va join bajarmaydi, bitta qatorni o‘qiydi.
+# reconcile_store_stats jadvalni noldan qayta quradi (tekshirish yoki tiklash uchun).
+#
+# total_orders      - do‘kon baglari bo‘yicha order_items soni (avvalgi hisob bilan bir xil)
+# items_sold        - "completed" buyurtmalardagi miqdor
+# revenue           - "completed" buyurtmalardagi quantity * unit_price
+# discount_pct_sum  - baglar chegirma foizlari yig‘indisi (o‘rtacha = / total_bags)
+
+_DISCOUNT_PCT = (
+    "(CASE WHEN {b}.original_price > 0 "
+    "THEN (1.0 - {b}.discount_price / {b}.original_price) * 100.0 ELSE 0 END)"
+)
+
+# Buyurtma holati "completed" ga o‘tganda (+1) yoki undan chiqqanda (-1)
+_COMPLETED_DELTA = """
+    UPDATE store_stats SET
+        items_sold = items_sold + {sign} * (
+            SELECT COALESCE(SUM(oi.quantity), 0) FROM order_items oi
+            JOIN surprise_bags b ON b.id = oi.surprise_bag_id
+            WHERE oi.order_id = new.id AND b.store_id = store_stats.store_id
+        ),
+        revenue = revenue + {sign} * (
+            SELECT COALESCE(SUM(oi.quantity * COALESCE(oi.unit_price, b.discount_price)), 0) FROM order_items oi
+            JOIN surprise_bags b ON b.id = oi.surprise_bag_id
+            WHERE oi.order_id = new.id AND b.store_id = store_stats.store_id
+        )
+    WHERE store_id IN (
+        SELECT b.store_id FROM order_items oi
+        JOIN surprise_bags b ON b.id = oi.surprise_bag_id
+        WHERE oi.order_id = new.id
+    );
+"""
+
+_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS store_stats_bag_ai AFTER INSERT ON surprise_bags BEGIN
+        INSERT OR IGNORE INTO store_stats (store_id) VALUES (new.store_id);
+        UPDATE store_stats SET
+            total_bags = total_bags + 1,
+            active_bags = active_bags + (new.status = 'available'),
+            discount_pct_sum = discount_pct_sum + {_DISCOUNT_PCT.format(b="new")}
+        WHERE store_id = new.store_id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS store_stats_bag_au
+    AFTER UPDATE OF status, original_price, discount_price, store_id ON surprise_bags BEGIN
+        UPDATE store_stats SET
+            active_bags = active_bags - (old.status = 'available'),
+            discount_pct_sum = discount_pct_sum - {_DISCOUNT_PCT.format(b="old")}
+        WHERE store_id = old.store_id;
+        INSERT OR IGNORE INTO store_stats (store_id) VALUES (new.store_id);
+        UPDATE store_stats SET
+            active_bags = active_bags + (new.status = 'available'),
+            discount_pct_sum = discount_pct_sum + {_DISCOUNT_PCT.format(b="new")}
+        WHERE store_id = new.store_id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS store_stats_bag_ad AFTER DELETE ON surprise_bags BEGIN
+        UPDATE store_stats SET
+            total_bags = total_bags - 1,
+            active_bags = active_bags - (old.status = 'available'),
+            discount_pct_sum = discount_pct_sum - {_DISCOUNT_PCT.format(b="old")},
+            total_orders = total_orders - (
+                SELECT COUNT(*) FROM order_items WHERE surprise_bag_id = old.id
+            ),
+            items_sold = items_sold - (
+                SELECT COALESCE(SUM(oi.quantity), 0) FROM order_items oi
+                JOIN orders o ON o.id = oi.order_id
+                WHERE oi.surprise_bag_id = old.id AND o.status = 'completed'
+            ),
+            revenue = revenue - (
+                SELECT COALESCE(SUM(oi.quantity * COALESCE(oi.unit_price, old.discount_price)), 0) FROM order_items oi
+                JOIN orders o ON o.id = oi.order_id
+                WHERE oi.surprise_bag_id = old.id AND o.status = 'completed'
+            )
+        WHERE store_id = old.store_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS store_stats_item_ai AFTER INSERT ON order_items BEGIN
+        UPDATE store_stats SET total_orders = total_orders + 1
+        WHERE store_id = (SELECT store_id FROM surprise_bags WHERE id = new.surprise_bag_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS store_stats_item_ad AFTER DELETE ON order_items BEGIN
+        UPDATE store_stats SET total_orders = total_orders - 1
+        WHERE store_id = (SELECT store_id FROM surprise_bags WHERE id = old.surprise_bag_id);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS store_stats_order_completed
+    AFTER UPDATE OF status ON orders
+    WHEN new.status = 'completed' AND old.status IS NOT 'completed' BEGIN
+        {_COMPLETED_DELTA.format(sign="1")}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS store_stats_order_uncompleted
+    AFTER UPDATE OF status ON orders
+    WHEN old.status = 'completed' AND new.status IS NOT 'completed' BEGIN
+        {_COMPLETED_DELTA.format(sign="-1")}
+    END
+    """,
+]
+
+_REBUILD = f"""
+    INSERT INTO store_stats (store_id, total_bags, active_bags, total_orders, items_sold, revenue, discount_pct_sum)
+    SELECT u.id,
+           COALESCE(bags.total_bags, 0),
+           COALESCE(bags.active_bags, 0),
+           COALESCE(sales.total_orders, 0),
+           COALESCE(sales.items_sold, 0),
+           COALESCE(sales.revenue, 0),
+           COALESCE(bags.discount_pct_sum, 0)
+    FROM users u
+    LEFT JOIN (
+        SELECT b.store_id,
+               COUNT(*) AS total_bags,
+               SUM(b.status = 'available') AS active_bags,
+               SUM({_DISCOUNT_PCT.format(b="b")}) AS discount_pct_sum
+        FROM surprise_bags b
+        GROUP BY b.store_id
+    ) bags ON bags.store_id = u.id
+    LEFT JOIN (
+        SELECT b.store_id,
+               COUNT(*) AS total_orders,
+               SUM(CASE WHEN o.status = 'completed' THEN oi.quantity ELSE 0 END) AS items_sold,
+               SUM(CASE WHEN o.status = 'completed'
+                        THEN oi.quantity * COALESCE(oi.unit_price, b.discount_price) ELSE 0 END) AS revenue
+        FROM order_items oi
+        JOIN orders o ON o.id = oi.order_id
+        JOIN surprise_bags b ON b.id = oi.surprise_bag_id
+        GROUP BY b.store_id
+    ) sales ON sales.store_id = u.id
+    WHERE u.role = 'store' OR bags.store_id IS NOT NULL
+"""
+
+
+def init_store_stats(engine):
+    """
+    Triggerlarni yaratadi (store_stats jadvalini create_all yaratadi).
+    Triggerlar birinchi marta o‘rnatilayotgan bo‘lsa, jadval mavjud ma’lumotdan to‘ldiriladi.
+    """
+    with engine.begin() as conn:
+        installed = conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'store_stats_bag_ai'")
+        ).first()
+        for statement in _TRIGGERS:
+            conn.exec_driver_sql(statement)
+        if not installed:
+            conn.exec_driver_sql("DELETE FROM store_stats")
+            conn.exec_driver_sql(_REBUILD)
+
+
+def reconcile_store_stats(db: Session) -> int:
+    """
+    Jadvalni noldan qayta quradi (bitta tranzaksiyada) va triggerlar bilan
+    farq qilgan do‘konlar sonini qaytaradi (0 - drift yo‘q).
+    """
+    columns = (
+        StoreStats.store_id, StoreStats.total_bags, StoreStats.active_bags, StoreStats.total_orders,
+        StoreStats.items_sold, StoreStats.revenue, StoreStats.discount_pct_sum
+    )
+    before = {row[0]: row for row in db.query(*columns)}
+    db.execute(text("DELETE FROM store_stats"))
+    db.execute(text(_REBUILD))
+    after = {row[0]: row for row in db.query(*columns)}
+    db.commit()
+
+    def same(a, b):
+        return a is not None and b is not None and all(abs((x or 0) - (y or 0)) < 1e-6 for x, y in zip(a, b))
+
+    return sum(1 for store_id in set(before) | set(after) if not same(before.get(store_id), after.get(store_id)))
+
+
+def load_store_stats(db: Session, store_id: int) -> dict:
+    row = db.query(
+        StoreStats.total_bags, StoreStats.active_bags, StoreStats.total_orders,
+        StoreStats.items_sold, StoreStats.revenue, StoreStats.discount_pct_sum
+    ).filter(StoreStats.store_id == store_id).first()
+    total_bags, active_bags, total_orders, items_sold, revenue, discount_pct_sum = row or (0, 0, 0, 0, 0.0, 0.0)
+    return {
+        "total_surprise_bags": total_bags,
+        "active_surprise_bags": active_bags,
+        "total_orders": total_orders,
+        "items_sold": items_sold,
+        "revenue": round(revenue, 2),
+        "average_discount_percentage": round(discount_pct_sum / total_bags, 2) if total_bags else 0.0
+    }
@@ -1,7 +1,102 @@
 from celery import Celery
+from database import SessionLocal
+from reservations import release_expired_holds
+from ledger import compact_balances
+from stats import reconcile_store_stats
+from expiry import sweep_expired_bags
+from outbox import dispatch_pending, begin_delivery, mark_delivered, prune_delivered
 
 celery_app = Celery("tasks", broker="redis://localhost:6380/0")
 
+celery_app.conf.beat_schedule = {
+    "dispatch-notifications-every-5-seconds": {
+        "task": "tasks.dispatch_notifications",
+        "schedule": 5.0,
+    },
+    "release-expired-holds-every-minute": {
+        "task": "tasks.release_expired_order_holds",
+        "schedule": 60.0,
+    },
+    "expire-surprise-bags-every-minute": {
+        "task": "tasks.expire_surprise_bags",
+        "schedule": 60.0,
+    },
+    "compact-balance-ledger-every-5-minutes": {
+        "task": "tasks.compact_balance_ledger",
+        "schedule": 300.0,
+    },
+    "reconcile-store-stats-hourly": {
+        "task": "tasks.reconcile_store_stats_table",
+        "schedule": 3600.0,
+    },
+}
+
+# Outbox dan kelgan bildirishnoma: dedup_key bo‘yicha takrorlar tashlanadi,
+# yetkazilgan deb faqat yuborilgandan keyin belgilanadi (at-least-once)
+@celery_app.task
+def send_notification(message: str, dedup_key: str = None):
+    if dedup_key is None:
+        print(f"Notification: {message}")
+        return
+    db = SessionLocal()
+    try:
+        if not begin_delivery(db, dedup_key):
+            return f"Duplicate {dedup_key} skipped"
+        print(f"Notification: {message}")
+        mark_delivered(db, dedup_key)
+    finally:
+        db.close()
+
+# Outbox ni partiyalab send_notification navbatiga bo‘shatish
+@celery_app.task
+def dispatch_notifications():
+    db = SessionLocal()
+    try:
+        dispatched = dispatch_pending(db, lambda dedup_key, message: send_notification.delay(message, dedup_key))
+        pruned = prune_delivered(db)
+        return f"Dispatched {dispatched} notifications, pruned {pruned}"
+    finally:
+        db.close()
+
+# Muddati o‘tgan zaxiralarni omborga qaytarish
+@celery_app.task
+def release_expired_order_holds():
+    db = SessionLocal()
+    try:
+        released = release_expired_holds(db)
+        return f"Released {released} expired orders"
+    finally:
+        db.close()
+
+# Muddati o‘tgan baglarni o‘chirish (is_active=False) va ulardagi zaxiralarni qaytarish
+@celery_app.task
+def expire_surprise_bags():
+    db = SessionLocal()
+    try:
+        result = sweep_expired_bags(db)
+        return (
+            f"Expired {result['expired_bags']} bags, cancelled {result['cancelled_holds']} holds, "
+            f"trimmed {result['trimmed_holds']} holds"
+        )
+    finally:
+        db.close()
+
+# Balans ledger uchun yangi snapshotlar yozish
+@celery_app.task
+def compact_balance_ledger():
+    db = SessionLocal()
+    try:
+        created = compact_balances(db)
+        return f"Wrote {created} balance snapshots"
+    finally:
+        db.close()
+
+# store_stats jadvalini noldan qayta hisoblash (triggerlar bilan farqni tuzatadi)
 @celery_app.task
-def send_notification(message: str):
-    print(f"Notification: {message}")
\ No newline at end of file
+def reconcile_store_stats_table():
+    db = SessionLocal()
+    try:
+        drifted = reconcile_store_stats(db)
+        return f"Reconciled store stats, {drifted} stores drifted"
+    finally:
+        db.close()
@@ -0,0 +1,135 @@
+import os
+import uuid
+from datetime import datetime
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+# Endpointlar natija hajmidan qat’i nazar bir xil sondagi SQL so‘rov bajarishi kerak (N+1 qaytib kelmasin).
+# Har bir endpoint 1 ta va ROWS ta qator bilan chaqiriladi, so‘rovlar engine dagi
+# before_cursor_execute hodisasi orqali sanaladi.
+
+ROWS = 10
+
+
+@pytest.fixture(scope="module")
+def app_module(tmp_path_factory):
+    # main bazani (./surplus_saver.db) va static/ papkasini joriy papkadan oladi:
+    # testlar vaqtinchalik papkadagi yangi bazada ishlaydi
+    workdir = tmp_path_factory.mktemp("surplus_saver")
+    os.makedirs(workdir / "static")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        import main
+        yield main
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture(scope="module")
+def client(app_module):
+    return TestClient(app_module.app)
+
+
+@pytest.fixture
+def queries(app_module):
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(app_module.engine, "before_cursor_execute", count)
+    yield statements
+    event.remove(app_module.engine, "before_cursor_execute", count)
+
+
+def auth(app_module, user):
+    token = app_module.create_access_token(data={"sub": user["email"], "role": user["role"]})
+    return {"Authorization": f"Bearer {token}"}
+
+
+def seed(app_module, rows, order_status="pending"):
+    """Do‘kon, `rows` ta bag va mijoz; mijozda `rows` ta buyurtma, har birida har bir bagdan bitta item."""
+    from models import User, SurpriseBag, Order, OrderItem
+
+    db = app_module.SessionLocal()
+    try:
+        suffix = uuid.uuid4().hex[:12]
+        store = User(name=f"Store {suffix}", email=f"store-{suffix}@example.com", phone=f"s-{suffix}",
+                     hashed_password="x", role="store", opening_balance=0.0)
+        customer = User(name=f"Customer {suffix}", email=f"customer-{suffix}@example.com", phone=f"c-{suffix}",
+                        hashed_password="x", role="customer", opening_balance=1000.0)
+        db.add_all([store, customer])
+        db.flush()
+
+        bags = [
+            SurpriseBag(title=f"Bag {i}", description="d", contents="c", original_price=10.0, discount_price=5.0,
+                        quantity=100, is_active=True, status="available", store_id=store.id,
+                        created_at=datetime.utcnow())
+            for i in range(rows)
+        ]
+        db.add_all(bags)
+        db.flush()
+
+        orders = []
+        for _ in range(rows):
+            order = Order(customer_id=customer.id, status=order_status, total_price=5.0 * rows)
+            db.add(order)
+            db.flush()
+            db.add_all(OrderItem(order_id=order.id, surprise_bag_id=bag.id, quantity=1, unit_price=5.0) for bag in bags)
+            orders.append(order.id)
+        db.commit()
+        return (
+            {"email": store.email, "role": "store"},
+            {"email": customer.email, "role": "customer"},
+            orders,
+        )
+    finally:
+        db.close()
+
+
+def count_request(client, queries, method, url, headers=None):
+    queries.clear()
+    response = client.request(method, url, headers=headers)
+    assert response.status_code == 200, response.text
+    return len(queries)
+
+
+@pytest.mark.parametrize("rows", [1, ROWS])
+def test_surprise_bags_query_count(app_module, client, queries, rows):
+    seed(app_module, rows)
+    assert count_request(client, queries, "GET", "/surprise-bags/") == 2
+
+
+@pytest.mark.parametrize("rows", [1, ROWS])
+def test_orders_query_count(app_module, client, queries, rows):
+    _, customer, _ = seed(app_module, rows)
+    assert count_request(client, queries, "GET", "/orders/", auth(app_module, customer)) == 3
+
+
+@pytest.mark.parametrize("rows", [1, ROWS])
+def test_store_orders_query_count(app_module, client, queries, rows):
+    store, _, _ = seed(app_module, rows)
+    assert count_request(client, queries, "GET", "/store/orders/", auth(app_module, store)) == 2
+
+
+@pytest.mark.parametrize("rows", [1, ROWS])
+def test_confirm_order_query_count(app_module, client, queries, rows):
+    _, customer, orders = seed(app_module, rows)
+    url = f"/orders/confirm/{orders[0]}/"
+    assert count_request(client, queries, "POST", url, auth(app_module, customer)) == 6
+
+
+@pytest.mark.parametrize("rows", [1, ROWS])
+def test_cancel_order_query_count(app_module, client, queries, rows):
+    _, customer, orders = seed(app_module, rows)
+    url = f"/orders/cancel/{orders[0]}/"
+    assert count_request(client, queries, "POST", url, auth(app_module, customer)) == 11
+
+
+@pytest.mark.parametrize("rows", [1, ROWS])
+def test_refund_order_query_count(app_module, client, queries, rows):
+    _, customer, orders = seed(app_module, rows, order_status="completed")
+    url = f"/orders/refund/{orders[0]}/"
+    assert count_request(client, queries, "POST", url, auth(app_module, customer)) == 14
@@ -0,0 +1,315 @@
+import argparse
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import time
+import uuid
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from fastapi import HTTPException, UploadFile
+from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.staticfiles import NotModifiedResponse
+from sqlalchemy import update, delete, select, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import SurpriseBag, StoredImage
+
+# Rasm yuklash: fayl bo‘laklab (chunk) diskka yoziladi; yuklovchi endpointlar sinxron (thread pool da),
+# shuning uchun katta rasm ham, SQLite lock ini kutish ham event loop ni to‘xtatib qo‘ymaydi.
+# Hajm MAX_UPLOAD_BYTES bilan cheklangan.
+# Saqlash content-addressed: fayl nomi - SHA-256 hash, static/uploads/ab/cd/<hash>.<ext>.
+# Bir xil rasm bir marta saqlanadi; stored_images.ref_count nechta bag unga ishora qilishini sanaydi.
+# Thumbnaillar (WebP, bir nechta kenglikda) rasm yonida, javob qaytgandan keyin process pool da yasaladi.
+
+UPLOAD_DIR = "static/uploads"
+TMP_DIR = os.path.join(UPLOAD_DIR, "tmp")
+MAX_UPLOAD_BYTES = 5 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+THUMBNAIL_WIDTHS = (160, 320, 640)
+# Yuklanayotgan fayllarni GC o‘chirib yubormasligi uchun
+GC_GRACE_SECONDS = 60 * 60
+
+# Format fayl mazmunidan (PIL) aniqlanadi, mijoz bergan fayl nomiga ishonilmaydi; boshqa formatlar - 400
+IMAGE_EXTENSIONS = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp"}
+
+_SHARD_RE = re.compile(r"^[0-9a-f]{2}$")
+_process_pool = None
+
+logger = logging.getLogger(__name__)
+
+
+def _get_process_pool():
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=2)
+    return _process_pool
+
+
+def shutdown_process_pool():
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=True)
+        _process_pool = None
+
+
+def content_path(digest: str, extension: str) -> str:
+    return os.path.join(UPLOAD_DIR, digest[:2], digest[2:4], f"{digest}.{extension}")
+
+
+def _write_chunk(f, hasher, chunk: bytes):
+    hasher.update(chunk)
+    f.write(chunk)
+
+
+def detect_extension(path: str):
+    """Ruxsat etilgan rasm bo‘lsa kengaytmani ("jpg", "png", "webp"), aks holda None qaytaradi."""
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        with Image.open(path) as image:
+            image_format = image.format
+            image.verify()
+    except (UnidentifiedImageError, OSError, SyntaxError):
+        return None
+    return IMAGE_EXTENSIONS.get(image_format)
+
+
+def _store_file(tmp_path: str, final_path: str):
+    os.makedirs(os.path.dirname(final_path), exist_ok=True)
+    os.replace(tmp_path, final_path)
+
+
+def save_upload(db: Session, image: UploadFile) -> StoredImage:
+    """
+    Rasmni bo‘laklab saqlaydi (hash bilan birga), hajmdan oshsa 413, JPEG/PNG/WebP bo‘lmasa 400.
+    Shu hash li rasm allaqachon bo‘lsa, fayl qayta yozilmaydi - faqat ref_count oshadi.
+    StoredImage qaytaradi (commit chaqiruvchi endpointda).
+    Sinxron: endpoint thread pool da ishlaydi. Fayl avval to‘liq yoziladi va tekshiriladi, upsert dan
+    commit gacha await yo‘q - SQLite yozish lock i faqat qisqa DB ishi davomida ushlanadi.
+    """
+    tmp_path = os.path.join(TMP_DIR, f"{uuid.uuid4()}.part")
+    hasher = hashlib.sha256()
+
+    written = 0
+    try:
+        with open(tmp_path, "wb") as f:
+            while True:
+                chunk = image.file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > MAX_UPLOAD_BYTES:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"Image is too large (max {MAX_UPLOAD_BYTES // (1024 * 1024)} MB)"
+                    )
+                _write_chunk(f, hasher, chunk)
+        extension = detect_extension(tmp_path)
+        if extension is None:
+            raise HTTPException(status_code=400, detail="Image must be a JPEG, PNG or WebP file")
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+    digest = hasher.hexdigest()
+    final_path = content_path(digest, extension)
+
+    # Bitta atomik upsert: qator bo‘lsa ref_count oshadi, bo‘lmasa (yoki shu orada purge/GC o‘chirgan
+    # bo‘lsa) yangisi yoziladi. Yozish lock i commit gacha turadi, shuning uchun purge bu qatorni
+    # oradan o‘chira olmaydi va quyidagi .one() har doim qatorni topadi.
+    db.execute(
+        sqlite_insert(StoredImage)
+        .values(
+            hash=digest, url="/" + final_path.replace(os.sep, "/"), size=written,
+            ref_count=1, created_at=datetime.utcnow()
+        )
+        .on_conflict_do_update(
+            index_elements=[StoredImage.hash],
+            set_={"ref_count": StoredImage.ref_count + 1}
+        )
+    )
+    stored_image = db.query(StoredImage).populate_existing().filter(StoredImage.hash == digest).one()
+
+    # Fayl allaqachon bor bo‘lsa qayta yozilmaydi; yo‘q bo‘lsa (yangi yoki qayta yaratilgan qator) joyiga qo‘yiladi
+    stored_path = stored_image.url.lstrip("/")
+    if os.path.exists(stored_path):
+        os.remove(tmp_path)
+    else:
+        _store_file(tmp_path, stored_path)
+    return stored_image
+
+
+def release_image(db: Session, image_url: str):
+    """Bag rasmdan voz kechganda ref_count ni kamaytiradi (commit chaqiruvchida)."""
+    if image_url:
+        db.execute(
+            update(StoredImage)
+            .where(StoredImage.url == image_url)
+            .values(ref_count=StoredImage.ref_count - 1)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def purge_unreferenced_image(db: Session, image_url: str):
+    """
+    Commit dan keyin chaqiriladi: rasmga hech kim ishora qilmasa, fayl va thumbnaillar o‘chiriladi.
+    stored_images da yo‘q eski (uuid nomli) rasmlar avvalgidek darhol o‘chiriladi.
+    """
+    if not image_url:
+        return
+    if not db.query(StoredImage.hash).filter(StoredImage.url == image_url).first():
+        delete_image(image_url)
+        return
+    deleted = db.execute(
+        delete(StoredImage)
+        .where(StoredImage.url == image_url, StoredImage.ref_count == 0)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    if deleted:
+        delete_image(image_url)
+
+
+def thumbnail_path(image_url: str, width: int) -> str:
+    source = image_url.lstrip("/")
+    stem = os.path.splitext(os.path.basename(source))[0]
+    return os.path.join(os.path.dirname(source), f"{stem}_{width}.webp")
+
+
+def thumbnail_url(image_url: str, width: int) -> str:
+    return "/" + thumbnail_path(image_url, width).replace(os.sep, "/")
+
+
+def make_thumbnails(source_path: str, widths=THUMBNAIL_WIDTHS):
+    """Process pool ichida ishlaydi: har bir kenglik uchun WebP thumbnail yozadi."""
+    from PIL import Image, ImageOps
+
+    done = []
+    with Image.open(source_path) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGB")
+        for width in widths:
+            thumbnail = image.copy()
+            if thumbnail.width > width:
+                height = max(1, round(thumbnail.height * width / thumbnail.width))
+                thumbnail = thumbnail.resize((width, height), Image.LANCZOS)
+            thumbnail.save(thumbnail_path(source_path, width), "WEBP", quality=80, method=4)
+            done.append(width)
+    return done
+
+
+async def generate_thumbnails(bag_id: int, image_url: str):
+    """Background task: thumbnaillarni yasab, tayyor kengliklarni rasm va unga ishora qiluvchi baglarga yozadi."""
+    loop = asyncio.get_running_loop()
+    try:
+        widths = await loop.run_in_executor(_get_process_pool(), make_thumbnails, image_url.lstrip("/"))
+    except Exception:
+        logger.exception("Thumbnail generation failed for bag %s", bag_id)
+        return
+
+    def mark_ready():
+        thumbnail_widths = ",".join(str(width) for width in widths)
+        db = SessionLocal()
+        try:
+            # Shu orada rasm almashtirilgan baglar yangilanmaydi (image_url sharti)
+            db.execute(
+                update(SurpriseBag)
+                .where(SurpriseBag.image_url == image_url)
+                .values(thumbnail_widths=thumbnail_widths)
+            )
+            db.execute(
+                update(StoredImage)
+                .where(StoredImage.url == image_url)
+                .values(thumbnail_widths=thumbnail_widths)
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    await run_in_threadpool(mark_ready)
+
+
+def delete_image(image_url: str):
+    """Asosiy rasm va uning thumbnaillarini o‘chiradi."""
+    paths = [image_url.lstrip("/")] + [thumbnail_path(image_url, width) for width in THUMBNAIL_WIDTHS]
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+# Content-addressed fayllar o‘zgarmaydi: brauzer va CDN ularni cheksiz keshlashi mumkin.
+# ETag - fayl nomidagi hash (thumbnail uchun hash_kenglik), mtime ga bog‘liq emas.
+class ImmutableStaticFiles(StaticFiles):
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200):
+        request_headers = Headers(scope=scope)
+        response = FileResponse(full_path, status_code=status_code, stat_result=stat_result)
+        response.headers["cache-control"] = "public, max-age=31536000, immutable"
+        stem = os.path.splitext(os.path.basename(str(full_path)))[0]
+        if re.match(r"^[0-9a-f]{64}(_\d+)?$", stem):
+            response.headers["etag"] = f'"{stem}"'
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+def collect_garbage(db: Session, grace_seconds: int = GC_GRACE_SECONDS) -> dict:
+    """
+    1) ref_count larni surprise_bags dan qayta hisoblaydi;
+    2) hech kim ishora qilmaydigan rasmlarni (fayl + thumbnail + qator) o‘chiradi;
+    3) shard papkalaridagi jadvalda yo‘q (yetim) fayllarni va eski .part fayllarni o‘chiradi.
+    """
+    db.execute(update(StoredImage).values(
+        ref_count=select(func.count(SurpriseBag.id))
+        .where(SurpriseBag.image_url == StoredImage.url)
+        .scalar_subquery()
+    ))
+    unreferenced = [url for (url,) in db.query(StoredImage.url).filter(StoredImage.ref_count <= 0)]
+    db.query(StoredImage).filter(StoredImage.ref_count <= 0).delete(synchronize_session=False)
+    db.commit()
+    for url in unreferenced:
+        delete_image(url)
+
+    known = set()
+    for (url,) in db.query(StoredImage.url):
+        known.add(os.path.normpath(url.lstrip("/")))
+        known.update(os.path.normpath(thumbnail_path(url, width)) for width in THUMBNAIL_WIDTHS)
+    cutoff = time.time() - grace_seconds
+    orphans = 0
+    for shard in os.listdir(UPLOAD_DIR):
+        shard_dir = os.path.join(UPLOAD_DIR, shard)
+        if not (_SHARD_RE.match(shard) and os.path.isdir(shard_dir)):
+            continue
+        for root, _, files in os.walk(shard_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                if os.path.normpath(path) in known or os.path.getmtime(path) > cutoff:
+                    continue
+                os.remove(path)
+                orphans += 1
+    if os.path.isdir(TMP_DIR):
+        for name in os.listdir(TMP_DIR):
+            path = os.path.join(TMP_DIR, name)
+            if os.path.getmtime(path) <= cutoff:
+                os.remove(path)
+                orphans += 1
+    return {"unreferenced_images": len(unreferenced), "orphan_files": orphans}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Yuklangan rasmlar uchun garbage collection")
+    parser.add_argument("command", choices=["gc"])
+    parser.add_argument("--grace-seconds", type=int, default=GC_GRACE_SECONDS)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        print(collect_garbage(db, grace_seconds=args.grace_seconds))
+    finally:
+        db.close()